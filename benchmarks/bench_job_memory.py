@@ -0,0 +1,98 @@
+#!/opt/cups_monitor_env/bin/python3
+import os
+import subprocess
+import sys
+
+# Mede o pico de memória (ru_maxrss) de um ciclo do monitor lendo o histórico de
+# jobs concluídos de uma vez, com todos os atributos (getJobs antigo), contra a
+# leitura em blocos de job_source.iter_completed_jobs. Cada cenário roda em um
+# processo próprio com um CUPS falso que gera os jobs sob demanda.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY_SIZES = [int(n) for n in os.getenv("BENCH_JOBS", "10000,50000,200000").split(",")]
+CHUNK_SIZE = int(os.getenv("BENCH_CHUNK", "500"))
+
+# Roda no processo filho: argv = modo, jobs no histórico, tamanho do bloco
+CHILD = r'''
+import resource, sys
+from job_source import iter_completed_jobs
+from page_cost import extract_cost, sheets_to_impressions
+
+# Atributos que o CUPS devolve por job quando requested_attributes não é informado
+EXTRA_ATTRIBUTES = [
+    'job-uri', 'job-uuid', 'job-printer-state-message', 'job-printer-state-reasons',
+    'job-state-reasons', 'job-state-message', 'job-k-octets', 'job-priority',
+    'job-hold-until', 'job-sheets', 'job-originating-host-name', 'document-format',
+    'document-name-supplied', 'copies', 'number-up', 'orientation-requested',
+    'time-at-creation', 'time-at-processing', 'date-time-at-creation',
+    'date-time-at-processing', 'date-time-at-completed', 'job-printer-up-time',
+]
+
+class FakeCups:
+    def __init__(self, total):
+        self.total = total
+
+    def job(self, job_id, attributes):
+        attrs = {
+            'job-id': job_id,
+            'job-printer-uri': f'ipp://localhost/printers/impressora-{job_id % 40:02d}',
+            'job-originating-user-name': f'usuario{job_id % 700}',
+            'job-name': f'documento-{job_id}.pdf',
+            'job-state': 9,
+            'time-at-completed': 1700000000 + job_id,
+            'job-media-sheets-completed': job_id % 17 + 1,
+            'print-color-mode': 'color' if job_id % 5 == 0 else 'monochrome',
+            'sides': 'two-sided-long-edge' if job_id % 3 == 0 else 'one-sided',
+            'media': 'iso_a4_210x297mm',
+        }
+        if attributes is None:
+            for name in EXTRA_ATTRIBUTES:
+                attrs[name] = f'{name}-{job_id}'
+        else:
+            attrs = {k: v for k, v in attrs.items() if k in attributes}
+        return attrs
+
+    def getJobs(self, my_jobs=False, which_jobs='completed', first_job_id=1, limit=-1,
+                requested_attributes=None):
+        last = self.total if limit < 0 else min(self.total, first_job_id + limit - 1)
+        return {jid: self.job(jid, requested_attributes) for jid in range(first_job_id, last + 1)}
+
+mode, total, chunk_size = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+conn = FakeCups(total)
+if mode == 'antigo':
+    chunks = [conn.getJobs(my_jobs=False, which_jobs='completed')]
+elif mode == 'blocos':
+    chunks = iter_completed_jobs(conn, 1, chunk_size)
+else:
+    chunks = []
+
+jobs = cost = 0
+for chunk in chunks:
+    for job_id, attrs in chunk.items():
+        jobs += 1
+        cost += extract_cost(attrs, sheets_to_impressions(attrs, attrs['job-media-sheets-completed']))
+    del chunk
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, jobs)
+'''
+
+def run(mode, total):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.getenv("PYTHONPATH")])))
+    out = subprocess.run([sys.executable, "-c", CHILD, mode, str(total), str(CHUNK_SIZE)],
+                         check=True, env=env, cwd=REPO_DIR, capture_output=True, text=True).stdout.split()
+    return int(out[0]) / 1024, int(out[1])
+
+def main():
+    baseline, _ = run("vazio", 0)
+    print(f"Pico de memória acima do interpretador ({baseline:.1f} MB); blocos de {CHUNK_SIZE} jobs")
+    print(f"{'JOBS NO HISTÓRICO':>18} {'ANTIGO':>10} {'BLOCOS':>10} {'REDUÇÃO':>9}")
+    print("-" * 52)
+    for total in HISTORY_SIZES:
+        full, full_jobs = run("antigo", total)
+        chunked, chunked_jobs = run("blocos", total)
+        assert full_jobs == chunked_jobs == total
+        full -= baseline
+        chunked -= baseline
+        print(f"{total:>18} {full:>8.1f}MB {chunked:>8.1f}MB {1 - chunked / full:>8.0%}")
+
+if __name__ == "__main__":
+    main()
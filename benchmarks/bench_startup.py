@@ -0,0 +1,93 @@
+#!/opt/cups_monitor_env/bin/python3
+import os
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Mede chamadas reais do ponto de entrada único (imports preguiçosos) contra as
+# mesmas chamadas com os imports antecipados que os scripts antigos faziam ao
+# iniciar. Cada execução é um processo novo, do início do interpretador à saída
+# do subcomando.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = int(os.getenv("BENCH_RUNS", "15"))
+
+def eager_imports():
+    """Imports que os scripts antigos faziam logo ao iniciar"""
+    modules = ["mysql.connector", "dotenv", "smtplib", "email.mime.text", "email.mime.multipart"]
+    try:
+        import cups  # noqa: F401
+        modules.append("cups")
+    except ImportError:
+        pass
+    return "import " + ", ".join(modules)
+
+# (nome, argumentos do printquota); status lê um snapshot recente gravado pelo benchmark
+SCENARIOS = [
+    ("status (snapshot)", ["status"]),
+    ("quotas (MySQL)", ["quotas"]),
+    ("enable --dry-run (CUPS)", ["enable", "__bench_nenhuma__", "--dry-run"]),
+]
+
+CHILD = """
+import sys, json
+import quota_status
+quota_status.STATUS_SNAPSHOT = sys.argv[1]
+import printquota
+code = printquota.main(json.loads(sys.argv[2]))
+sys.exit(code or 0)
+"""
+
+def write_snapshot(directory):
+    path = os.path.join(directory, "status.json")
+    printers = [{'name': f"IMPRESSORA_{i:02d}", 'monthly_quota': 1000, 'current_count': 10 * i,
+                 'usage_percent': i, 'remaining_pages': 1000 - 10 * i, 'cups_state': "ociosa",
+                 'accepting': True, 'queued_jobs': 0} for i in range(40)]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({'generated_at': time.time(), 'printers': printers, 'alerts': []}, f)
+    return path
+
+def run_once(preamble, snapshot, argv):
+    """Duração em ms, ou None se o subcomando falhou (sem MySQL/CUPS neste host)"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.getenv("PYTHONPATH")])))
+    code = preamble + "\n" + CHILD
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code, snapshot, json.dumps(argv)],
+                            env=env, cwd=REPO_DIR, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - started) * 1000
+    if result.returncode != 0 or "Erro" in result.stdout:
+        return None
+    return elapsed
+
+def measure(preamble, snapshot, argv):
+    timings = []
+    for _ in range(RUNS):
+        elapsed = run_once(preamble, snapshot, argv)
+        if elapsed is None:
+            return None
+        timings.append(elapsed)
+    return statistics.median(timings)
+
+def main():
+    eager = eager_imports()
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot = write_snapshot(directory)
+        print(f"{'CHAMADA':<26} {'PREGUIÇOSO':>11} {'ANTECIPADO':>11} {'ECONOMIA':>9}   "
+              f"(mediana de {RUNS} execuções)")
+        print("-" * 76)
+        for name, argv in SCENARIOS:
+            lazy = measure("", snapshot, argv)
+            if lazy is None:
+                print(f"{name:<26} {'indisponível neste host (sem MySQL/CUPS?)':>44}")
+                continue
+            eager_ms = measure(eager, snapshot, argv)
+            if eager_ms is None:
+                print(f"{name:<26} {lazy:>9.1f}ms {'falhou':>11}")
+                continue
+            print(f"{name:<26} {lazy:>9.1f}ms {eager_ms:>9.1f}ms {(eager_ms - lazy) / eager_ms:>8.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,23 @@ import cups
 import mysql.connector
 import logging
 import time
+import signal
+import sys
+import json
 import subprocess
+from collections import defaultdict
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import os
 
+from page_cost import first_value, extract_cost, sheets_to_impressions
+from page_log import new_tail_state, tail_page_totals, pop_job_pages
+from usage_rollup import apply_rollup
+from quota_status import STATUS_SNAPSHOT, collect_status, write_snapshot
+import notifications
+from monitor_logging import setup_logging
+from job_source import JOB_ATTRIBUTES, iter_completed_jobs, end_cycle, source_time
+
 # Carregar variáveis do .env
 load_dotenv("/opt/cups_monitor_env/.env")
 
@@ -19,11 +31,31 @@ MYSQL_DB   = os.getenv("MYSQL_DB")
 CHECK_INTERVAL = 5
 DAYS_TO_LOOK_BACK = 1
 LOG_FILE = "/var/log/cups_monitor.log"
+LOG_LEVEL = logging.INFO  # logging.DEBUG volta a registrar cada job
+LOG_JSON = False          # True grava o log do serviço em JSON lines
+
+# Contagem de páginas pelo page_log do CUPS (mais precisa que os atributos IPP)
+PAGE_LOG_TAIL = True
+PAGE_LOG_FILE = "/var/log/cups/page_log"
+
+# Jobs concluídos lidos por chamada ao CUPS (0 = todo o histórico em uma chamada)
+JOB_CHUNK_SIZE = 500
+
+# Duração máxima esperada de um ciclo no modo --ha (leader.STALL_TIMEOUT precisa cobri-la)
+MAX_CYCLE_SECONDS = 30
+
+# Checkpoint dos jobs já liquidados, gravado a cada ciclo e no SIGTERM
+MONITOR_CHECKPOINT = "/var/lib/cups_monitor/monitor_checkpoint.json"
 
 # Configurações de cotas
 QUOTA_CHECK_ENABLED = True
-QUOTA_WARNING_THRESHOLD = 0.9  # Alerta quando atingir 90% da cota
+ALERT_BANDS = (70, 90, 100)  # Faixas (% da cota) que geram alerta ao serem cruzadas
+CUPS_STOPPED = 5             # printer-state de fila parada (cupsdisable)
 ADMIN_EMAIL = "rafaelrbf@fab.mil.br"
+DEFAULT_MONTHLY_QUOTA = 1000  # Cota das impressoras descobertas no CUPS
+
+# Sincronização das filas do CUPS com a tabela printers
+PRINTER_SYNC_INTERVAL = 300  # segundos; também roda quando um job cita fila desconhecida
 
 # ========== LOG ==========
 logging.basicConfig(filename=LOG_FILE, level=logging.INFO,
@@ -41,6 +73,46 @@ def get_db_connection():
     )
 
 # ========== QUOTA MANAGEMENT ==========
+def printer_ip(attrs):
+    """Extrai o IP do DeviceURI (socket://IP:PORTA)"""
+    device_uri = attrs.get('device-uri', '')
+    if 'socket://' in device_uri:
+        return device_uri.replace('socket://', '').split(':')[0]
+    return 'unknown'
+
+def sync_printers(cursor, cups_printers):
+    """Sincroniza a tabela printers com as filas do CUPS por conjunto.
+
+    Uma consulta carrega todos os nomes conhecidos; filas novas entram em um único
+    INSERT com a cota padrão, filas que sumiram do CUPS recebem removed_at (o
+    histórico e a cota são mantidos) e filas recriadas voltam a ficar ativas.
+    Retorna todos os nomes cadastrados (ativos ou não). O commit fica com quem chama.
+    """
+    cursor.execute("SELECT name, removed_at FROM printers")
+    known = {row['name']: row['removed_at'] for row in cursor.fetchall()}
+
+    added = [(name, printer_ip(attrs), DEFAULT_MONTHLY_QUOTA, 0)
+             for name, attrs in cups_printers.items() if name not in known]
+    restored = [(name,) for name in cups_printers if name in known and known[name] is not None]
+    removed = [(name,) for name, removed_at in known.items()
+               if removed_at is None and name not in cups_printers]
+
+    if added:
+        cursor.executemany("""
+            INSERT INTO printers (name, ip_address, monthly_quota, current_count, created_at, updated_at)
+            VALUES (%s, %s, %s, %s, NOW(), NOW())
+        """, added)
+        for name, _, quota, _ in added:
+            logging.info(f"Impressora {name} adicionada ao sistema com cota mensal de {quota} páginas")
+    if restored:
+        cursor.executemany("UPDATE printers SET removed_at = NULL, updated_at = NOW() WHERE name = %s", restored)
+        logging.info(f"Impressoras de volta ao CUPS: {', '.join(name for name, in restored)}")
+    if removed:
+        cursor.executemany("UPDATE printers SET removed_at = NOW(), updated_at = NOW() WHERE name = %s", removed)
+        logging.warning(f"Impressoras removidas do CUPS: {', '.join(name for name, in removed)}")
+
+    return set(known) | set(cups_printers)
+
 def initialize_printers_from_cups():
     """Inicializa impressoras do CUPS no banco de dados se não existirem"""
     db = get_db_connection()
@@ -48,28 +120,7 @@ def initialize_printers_from_cups():
     
     try:
         cups_conn = cups.Connection()
-        printers = cups_conn.getPrinters()
-        
-        for printer_name, attrs in printers.items():
-            # Verifica se a impressora já existe no banco
-            cursor.execute("SELECT id FROM printers WHERE name = %s", (printer_name,))
-            if cursor.fetchone():
-                continue
-                
-            # Extrai IP do DeviceURI
-            device_uri = attrs.get('device-uri', '')
-            ip_address = 'unknown'
-            if 'socket://' in device_uri:
-                ip_address = device_uri.replace('socket://', '').split(':')[0]
-            
-            # Insere nova impressora com cota padrão de 1000 páginas/mês
-            cursor.execute("""
-                INSERT INTO printers (name, ip_address, monthly_quota, current_count, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, NOW(), NOW())
-            """, (printer_name, ip_address, 1000, 0))
-            
-            logging.info(f"Impressora {printer_name} adicionada ao sistema com cota mensal de 1000 páginas")
-        
+        sync_printers(cursor, cups_conn.getPrinters())
         db.commit()
         
     except Exception as e:
@@ -88,16 +139,6 @@ def get_printer_quota_info(cursor, printer_name):
     """, (printer_name,))
     return cursor.fetchone()
 
-def update_printer_usage(cursor, db, printer_name, pages):
-    """Atualiza o uso da impressora"""
-    cursor.execute("""
-        UPDATE printers 
-        SET current_count = current_count + %s, updated_at = NOW()
-        WHERE name = %s
-    """, (pages, printer_name))
-    db.commit()
-    logging.info(f"Atualizado uso da impressora {printer_name}: +{pages} páginas")
-
 def check_quota_exceeded(cursor, printer_name, pages_to_add=0):
     """Verifica se a cota será excedida"""
     quota_info = get_printer_quota_info(cursor, printer_name)
@@ -109,20 +150,86 @@ def check_quota_exceeded(cursor, printer_name, pages_to_add=0):
     if total_after_print > quota_info['monthly_quota']:
         return True, f"Cota excedida: {total_after_print}/{quota_info['monthly_quota']} páginas"
     
-    # Verifica se está próximo do limite
-    usage_percentage = total_after_print / quota_info['monthly_quota']
-    if usage_percentage >= QUOTA_WARNING_THRESHOLD:
-        logging.warning(f"ALERTA: Impressora {printer_name} em {usage_percentage:.1%} da cota mensal")
+    # Verifica se está próximo do limite (só alerta ao cruzar uma nova faixa)
+    evaluate_alert_band(printer_name, total_after_print, quota_info['monthly_quota'])
     
     return False, f"OK: {total_after_print}/{quota_info['monthly_quota']} páginas"
 
+# ========== ALERTAS POR FAIXA ==========
+# Último nível alertado por impressora (espelho de printers.alert_level)
+alert_levels = {}
+# Alertas e níveis aguardando gravação em lote
+pending_alerts = []
+pending_levels = {}
+
+def alert_band(current, quota):
+    """Maior faixa de ALERT_BANDS atingida pelo uso (0 se nenhuma)"""
+    if not quota:
+        return 0
+    usage_percent = current * 100 / quota
+    level = 0
+    for band in ALERT_BANDS:
+        if usage_percent >= band:
+            level = band
+    return level
+
+def load_alert_levels(cursor):
+    """Carrega do banco o último nível alertado de cada impressora"""
+    cursor.execute("SELECT name, alert_level FROM printers")
+    alert_levels.clear()
+    for row in cursor.fetchall():
+        alert_levels[row['name']] = row['alert_level'] or 0
+
+def evaluate_alert_band(printer_name, current, quota, stored_level=None):
+    """Enfileira um alerta apenas quando a impressora cruza uma nova faixa.
+
+    Retorna True quando a faixa de 100% acaba de ser atingida.
+    """
+    last = alert_levels.get(printer_name, 0)
+    if stored_level is not None and stored_level < last:
+        # Nível zerado fora do monitor (reset mensal/manual)
+        last = stored_level
+        alert_levels[printer_name] = last
+
+    level = alert_band(current, quota)
+    if level == last:
+        return False
+
+    alert_levels[printer_name] = level
+    pending_levels[printer_name] = level
+    if level < last:
+        return False
+
+    alert_type = 'QUOTA_EXCEEDED' if level >= 100 else 'WARNING'
+    message = f"Uso atingiu {level}% da cota mensal"
+    pending_alerts.append((printer_name, alert_type, current, quota, message))
+    logging.warning(f"ALERTA: Impressora {printer_name} cruzou {level}% da cota ({current}/{quota})")
+    return level >= 100
+
+def flush_alerts(cursor, db):
+    """Grava em lote os alertas e níveis pendentes"""
+    if not pending_alerts and not pending_levels:
+        return
+    cycle_stats['alerts'] += len(pending_alerts)
+    if pending_alerts:
+        cursor.executemany("""
+            INSERT INTO quota_alerts (printer_name, alert_type, current_usage, quota_limit, message)
+            VALUES (%s, %s, %s, %s, %s)
+        """, pending_alerts)
+    if pending_levels:
+        cursor.executemany("UPDATE printers SET alert_level = %s WHERE name = %s",
+                           [(level, name) for name, level in pending_levels.items()])
+    db.commit()
+    pending_alerts.clear()
+    pending_levels.clear()
+
 def reset_monthly_quotas():
     """Reseta as cotas mensais (executar via cron no início de cada mês)"""
     db = get_db_connection()
     cursor = db.cursor()
     
     try:
-        cursor.execute("UPDATE printers SET current_count = 0, updated_at = NOW()")
+        cursor.execute("UPDATE printers SET current_count = 0, alert_level = 0, updated_at = NOW()")
         db.commit()
         logging.info("Cotas mensais resetadas para todas as impressoras")
         
@@ -138,8 +245,15 @@ def reset_monthly_quotas():
         cursor.close()
         db.close()
 
-def block_printer_job(printer_name, reason):
-    """Bloqueia trabalhos de impressão em uma impressora"""
+def block_printer_job(printer_name, reason, cups_conn=None):
+    """Bloqueia trabalhos de impressão em uma impressora.
+
+    Uma conexão com block_printer (replay) recebe o bloqueio no lugar do CUPS real.
+    """
+    block = getattr(cups_conn, 'block_printer', None)
+    if block is not None:
+        block(printer_name, reason)
+        return
     try:
         # Para a impressora no CUPS
         subprocess.run(['cupsdisable', printer_name], check=True)
@@ -152,7 +266,8 @@ def block_printer_job(printer_name, reason):
         # Opcional: Enviar notificação por email
         send_quota_notification(printer_name, reason)
         
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, OSError) as e:
+        # OSError: cupsdisable/cancel ausentes neste host
         logging.error(f"Erro ao bloquear/cancelar jobs da impressora {printer_name}: {e}")
 
 def unblock_printer_job(printer_name):
@@ -160,13 +275,14 @@ def unblock_printer_job(printer_name):
     try:
         subprocess.run(['cupsenable', printer_name], check=True)
         logging.info(f"Impressora desbloqueada: {printer_name}")
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, OSError) as e:
         logging.error(f"Erro ao desbloquear impressora {printer_name}: {e}")
 
 def send_quota_notification(printer_name, message):
-    """Envia notificação de cota (implementar conforme necessidade)"""
+    """Enfileira a notificação de cota (entregue em segundo plano, sem bloquear o ciclo)"""
     logging.info(f"NOTIFICAÇÃO COTA: {printer_name} - {message}")
-    # Aqui você pode implementar envio de email, webhook, etc.
+    recipients = (notifications.NOTIFY_EMAILS or [ADMIN_EMAIL]) + notifications.NOTIFY_WEBHOOKS
+    notifications.notify(f"Impressora {printer_name} bloqueada", message, recipients)
 
 # ========== INTERCEPTAÇÃO PRÉ-IMPRESSÃO ==========
 def check_job_before_printing(printer_name, pages):
@@ -179,6 +295,7 @@ def check_job_before_printing(printer_name, pages):
     
     try:
         exceeded, message = check_quota_exceeded(cursor, printer_name, pages)
+        flush_alerts(cursor, db)
         
         if exceeded:
             # Bloqueia a impressora
@@ -201,27 +318,43 @@ def cups_to_printer_name(uri):
     return str(uri).rstrip('/').split('/')[-1]
 
 def extract_pages(attrs):
-    for key in ('job-media-sheets-completed', 'job-pages-completed', 'job-impressions-completed'):
-        v = attrs.get(key)
+    """Faces impressas do job, como no page_log.
+
+    Prefere as contagens de faces do CUPS; folhas (job-media-sheets-completed) ficam
+    por último, porque em frente e verso só dão uma aproximação (sheets_to_impressions).
+    Um atributo zerado (driver que não conta) cede lugar ao seguinte.
+    """
+    reported = None
+    for key in ('job-impressions-completed', 'job-pages-completed', 'job-media-sheets-completed'):
+        v = first_value(attrs.get(key))
         if v is None:
             continue
-        if isinstance(v, (list, tuple)):
-            v = v[0] if v else None
         try:
-            return int(v)
+            pages = int(v)
         except:
             continue
-    return 1
-
-def insert_or_update_job(cursor, db, jid, printer, user, title, pages, completed_dt, attrs=None):
-    """Versão modificada que também atualiza cotas, ignorando jobs cancelados"""
+        if key == 'job-media-sheets-completed':
+            pages = sheets_to_impressions(attrs, pages)
+        if pages > 0:
+            return pages
+        reported = pages
+    return 1 if reported is None else reported
+
+def insert_or_update_job(cursor, jid, printer, user, title, pages, completed_dt, attrs=None, cost=None):
+    """Versão modificada que também atualiza cotas, ignorando jobs cancelados.
+
+    Não faz commit: o job entra no lote do ciclo, confirmado em flush_batch().
+    """
     state = attrs.get('job-state') if attrs else None
+    if cost is None:
+        cost = pages
 
     # Estados do CUPS:
     # 3 = pending, 4 = held, 5 = processing, 6 = stopped, 
     # 7 = aborted, 8 = canceled, 9 = completed
     if state in (7, 8):  # aborted ou canceled
-        logging.info(f"[IGNORADO] job_id={jid} (estado={state}) - não conta para cota")
+        logging.debug("[IGNORADO] job_id=%s (estado=%s) - não conta para cota", jid, state)
+        cycle_stats['ignored'] += 1
         return
 
     cursor.execute("SELECT id, completed_at FROM print_jobs WHERE job_id = %s", (jid,))
@@ -233,22 +366,76 @@ def insert_or_update_job(cursor, db, jid, printer, user, title, pages, completed
     if existing:
         cursor.execute("""
             UPDATE print_jobs
-            SET printer=%s, user=%s, title=%s, pages=%s, completed_at=%s, updated_at=NOW()
+            SET printer=%s, user=%s, title=%s, pages=%s, weighted_pages=%s, completed_at=%s, updated_at=NOW()
             WHERE job_id=%s
-        """, (printer, user, title, pages, completed_dt, jid))
-        logging.info("[UPDATE] job_id=%s pages=%s", jid, pages)
+        """, (printer, user, title, pages, cost, completed_dt, jid))
+        logging.debug("[UPDATE] job_id=%s pages=%s custo=%s", jid, pages, cost)
+        cycle_stats['updated'] += 1
     else:
+        # print_jobs particionada não garante job_id único: a reserva decide quem grava
+        cursor.execute("INSERT IGNORE INTO print_job_ids (job_id) VALUES (%s)", (jid,))
+        if cursor.rowcount == 0:
+            logging.debug("[DUPLICADO] job_id=%s já registrado por outro processo", jid)
+            return
         cursor.execute("""
-            INSERT INTO print_jobs (printer, user, job_id, title, pages, completed_at, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s, NOW(), NOW())
-        """, (printer, user, jid, title, pages, completed_dt))
-        logging.info("[INSERT] job_id=%s pages=%s", jid, pages)
-
+            INSERT INTO print_jobs (printer, user, job_id, title, pages, weighted_pages, completed_at, created_at, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+        """, (printer, user, jid, title, pages, cost, completed_dt))
+        logging.debug("[INSERT] job_id=%s pages=%s custo=%s", jid, pages, cost)
+        cycle_stats['inserted'] += 1
+
+    # Atualiza cotas e rollup apenas se o job foi concluído (pelo custo ponderado)
+    if state == 9 and cost and cost > 0:
+        record_usage(printer, user, completed_dt, pages, cost)
+
+# ========== ESCRITA EM LOTE ==========
+# Incrementos acumulados no ciclo, gravados junto com os jobs em um único commit
+usage_increments = defaultdict(int)                  # impressora -> custo
+rollup_increments = defaultdict(lambda: [0, 0, 0])   # (dia, impressora, usuário) -> [jobs, páginas, custo]
+cycle_stats = defaultdict(int)                       # contadores do resumo por ciclo no log
+
+def record_usage(printer, user, completed_dt, pages, cost):
+    """Acumula o uso do job nos contadores da impressora e no rollup diário"""
+    usage_increments[printer] += cost
+    totals = rollup_increments[(completed_dt.date(), printer, user)]
+    totals[0] += 1
+    totals[1] += pages or 0
+    totals[2] += cost
+
+def flush_batch(cursor, db):
+    """Aplica contadores e rollup diário e confirma o lote do ciclo"""
+    if usage_increments:
+        cursor.executemany("""
+            UPDATE printers 
+            SET current_count = current_count + %s, updated_at = NOW()
+            WHERE name = %s
+        """, [(cost, printer) for printer, cost in usage_increments.items()])
+        for printer, cost in usage_increments.items():
+            logging.debug("Atualizado uso da impressora %s: +%s páginas", printer, cost)
+        cycle_stats['printers'] += len(usage_increments)
+        cycle_stats['cost'] += sum(usage_increments.values())
+    if rollup_increments:
+        apply_rollup(cursor, rollup_increments)
     db.commit()
-
-    # Atualiza cotas apenas se o job foi concluído
-    if state == 9 and pages and pages > 0:
-        update_printer_usage(cursor, db, printer, pages)
+    discard_batch()
+
+def discard_batch():
+    """Descarta incrementos de um lote que sofreu rollback"""
+    usage_increments.clear()
+    rollup_increments.clear()
+
+def log_cycle_summary(started):
+    """Uma linha por ciclo com trabalho feito, no lugar de uma por job"""
+    stats = dict(cycle_stats)
+    cycle_stats.clear()
+    if not any(stats.get(key) for key in ('inserted', 'updated', 'alerts')):
+        return
+    stats['duration_ms'] = int((time.monotonic() - started) * 1000)
+    logging.info("Ciclo: %d novos, %d atualizados, %d ignorados, custo +%d em %d impressora(s), "
+                 "%d alerta(s), %d ms",
+                 stats.get('inserted', 0), stats.get('updated', 0), stats.get('ignored', 0),
+                 stats.get('cost', 0), stats.get('printers', 0), stats.get('alerts', 0),
+                 stats['duration_ms'], extra={'fields': {'cycle': stats}})
 
 def fetch_jobs_from_lpstat():
     """Versão original mantida"""
@@ -277,97 +464,354 @@ def fetch_jobs_from_lpstat():
     except subprocess.CalledProcessError:
         return []
 
-# ========== RELATÓRIOS ==========
-def generate_quota_report():
-    """Gera relatório de uso das cotas"""
-    db = get_db_connection()
-    cursor = db.cursor(dictionary=True)
-    
+# ========== CHECKPOINT ==========
+# Todo job com id <= watermark já foi liquidado, exceto os de pending_jobs (ainda
+# ativos quando o watermark passou por eles, conferidos um a um a cada ciclo); acima
+# do watermark, os ids em settled_jobs também já foram liquidados.
+# Só é atualizado depois do commit do ciclo, então nunca está à frente do banco.
+# lowest_seen (só em memória) é o menor job que o CUPS ainda retinha no ciclo anterior.
+checkpoint = {'watermark': 0, 'settled_jobs': set(), 'pending_jobs': set(),
+              'last_completed': None, 'lowest_seen': None}
+
+def checkpoint_state():
+    """Checkpoint serializável (arquivo local e heartbeat do líder)"""
+    return {
+        'watermark': checkpoint['watermark'],
+        'settled_jobs': sorted(checkpoint['settled_jobs']),
+        'pending_jobs': sorted(checkpoint['pending_jobs']),
+        'last_completed': checkpoint['last_completed'],
+        'saved_at': time.time(),
+    }
+
+def restore_checkpoint(data):
+    """Restaura o checkpoint a partir do dicionário salvo; False se for inválido"""
     try:
-        cursor.execute("""
-            SELECT name, monthly_quota, current_count, 
-                   ROUND((current_count / monthly_quota) * 100, 1) as usage_percent,
-                   (monthly_quota - current_count) as remaining_pages
-            FROM printers 
-            ORDER BY usage_percent DESC
-        """)
-        
-        print("\n" + "="*80)
-        print("RELATÓRIO DE COTAS DE IMPRESSÃO")
-        print("="*80)
-        print(f"{'IMPRESSORA':<20} {'COTA':<8} {'USADO':<8} {'%':<8} {'RESTANTE':<10}")
-        print("-"*80)
-        
-        for row in cursor.fetchall():
-            print(f"{row['name']:<20} {row['monthly_quota']:<8} {row['current_count']:<8} "
-                  f"{row['usage_percent']:<7}% {row['remaining_pages']:<10}")
-        
-        print("="*80)
-        
+        checkpoint['watermark'] = int(data['watermark'])
+        checkpoint['settled_jobs'] = {int(jid) for jid in data.get('settled_jobs', [])}
+        checkpoint['pending_jobs'] = {int(jid) for jid in data.get('pending_jobs', [])}
+        checkpoint['last_completed'] = data.get('last_completed')
+        return True
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return False
+
+def load_monitor_checkpoint(path=MONITOR_CHECKPOINT):
+    """Restaura o checkpoint do arquivo; retorna False se não houver um válido (ou path=None)"""
+    if not path:
+        return False
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return restore_checkpoint(data)
+
+def save_monitor_checkpoint(path=MONITOR_CHECKPOINT):
+    """Grava o checkpoint de forma atômica (arquivo temporário + rename); path=None não grava"""
+    if not path:
+        return
+    try:
+        write_snapshot(checkpoint_state(), path)
     except Exception as e:
-        logging.error(f"Erro ao gerar relatório: {e}")
-    finally:
-        cursor.close()
-        db.close()
+        logging.error(f"Erro ao gravar checkpoint: {e}")
+
+def start_as_leader(worst_cycle=MAX_CYCLE_SECONDS + CHECK_INTERVAL, checkpoint_path=MONITOR_CHECKPOINT):
+    """Modo ativo/passivo: espera a liderança e parte do checkpoint do líder anterior.
+
+    worst_cycle é o maior intervalo esperado entre dois heartbeat() do loop; com um
+    STALL_TIMEOUT menor a thread do líder pararia de renovar no meio de um ciclo longo.
+    LEASE_TIMEOUT só precisa cobrir alguns HEARTBEAT_INTERVAL (a thread não depende do ciclo).
+    """
+    import leader
+    if leader.STALL_TIMEOUT <= worst_cycle:
+        logging.error(f"STALL_TIMEOUT ({leader.STALL_TIMEOUT}s) precisa ser maior que o pior "
+                      f"ciclo ({worst_cycle}s)")
+        sys.exit(1)
+    if leader.LEASE_TIMEOUT < 3 * leader.HEARTBEAT_INTERVAL:
+        logging.error(f"LEASE_TIMEOUT ({leader.LEASE_TIMEOUT}s) precisa cobrir ao menos três "
+                      f"HEARTBEAT_INTERVAL ({leader.HEARTBEAT_INTERVAL}s)")
+        sys.exit(1)
+    data = leader.wait_for_leadership()
+    if data and restore_checkpoint(data):
+        return True
+    return load_monitor_checkpoint(checkpoint_path)
+
+def renew_leadership():
+    """Heartbeat do líder; se o lock foi perdido, sai para o systemd reiniciar como standby"""
+    import leader
+    if not leader.heartbeat(checkpoint_state()):
+        logging.error("Liderança perdida; encerrando para voltar como standby")
+        sys.exit(1)
+
+def confirm_leadership():
+    """Confere o lock antes de aplicar cotas (o standby pode ter assumido no meio do ciclo)"""
+    import leader
+    if not leader.still_leader():
+        logging.error("Liderança perdida durante o ciclo; encerrando sem aplicar cotas")
+        sys.exit(1)
+
+def step_down():
+    import leader
+    leader.heartbeat(checkpoint_state())
+    leader.release()
+
+def job_settled(job_id):
+    return job_id <= checkpoint['watermark'] or job_id in checkpoint['settled_jobs']
+
+def advance_checkpoint(settled, active_ids, lowest_seen, last_completed):
+    """Incorpora os jobs confirmados no ciclo e avança o watermark.
+
+    O watermark avança por ids liquidados ou ativos em sequência; os ativos que ficam
+    para trás vão para pending_jobs, então um job retido (held) não prende o watermark.
+    Um job adiado ou sem confirmação segura o avanço até ser gravado. Ids abaixo do
+    menor job retido pelo CUPS em dois ciclos seguidos (histórico expurgado ou jobs
+    removidos) não voltam mais e são pulados.
+    """
+    settled_jobs = checkpoint['settled_jobs']
+    settled_jobs.update(settled)
+    pending = (checkpoint['pending_jobs'] | set(active_ids)).difference(settled)
+    if last_completed and (checkpoint['last_completed'] or '') < last_completed:
+        checkpoint['last_completed'] = last_completed
+
+    watermark = checkpoint['watermark']
+    previous = checkpoint.get('lowest_seen')
+    checkpoint['lowest_seen'] = lowest_seen
+    if lowest_seen is not None and previous is not None:
+        watermark = max(watermark, min(lowest_seen, previous) - 1)
+    while watermark + 1 in settled_jobs or watermark + 1 in pending:
+        watermark += 1
+    checkpoint['watermark'] = watermark
+    checkpoint['settled_jobs'] = {jid for jid in settled_jobs if jid > watermark}
+    # Ativos acima do watermark voltam pela leitura dos concluídos
+    checkpoint['pending_jobs'] = {jid for jid in pending if jid <= watermark}
+
+def completed_record(job_id, attrs, page_totals, cutoff, tail_read_at, cycle):
+    """Registro a gravar de um job concluído, ou None.
+
+    Jobs sem conclusão ou fora da janela vão direto para cycle['settled']; jobs que
+    concluíram depois da leitura do page_log ficam para o próximo ciclo (as páginas
+    deles ainda podem não estar no log).
+    """
+    t = attrs.get('time-at-completed')
+    if tail_read_at is not None and t and int(t) >= tail_read_at:
+        return None
+    record = job_record(job_id, attrs, page_totals)
+    if record is None or record['completed_dt'] < cutoff:
+        cycle['settled'].append(job_id)
+        return None
+    return record
+
+def read_cycle_jobs(cups_conn, page_log_state, page_totals, cutoff, cycle):
+    """Gera os registros dos jobs concluídos ainda não liquidados.
+
+    Os pendentes que saíram da fila são conferidos um a um (getJobAttributes); os
+    demais concluídos são lidos em blocos a partir do watermark. cycle['active']
+    recebe os jobs ainda na fila e cycle['lowest_seen'] o menor job id retido pelo
+    CUPS, ativo ou concluído.
+    """
+    active = set(cups_conn.getJobs(my_jobs=False, which_jobs='not-completed', requested_attributes=['job-id']))
+    cycle['active'] = active
+    lowest_seen = min(active, default=None)
+
+    tail_read_at = None
+    if page_log_state is not None:
+        tail_read_at = int(time.time())
+        tail_page_totals(page_log_state, page_totals)
+
+    pending = checkpoint['pending_jobs']
+    for job_id in sorted(pending - active):
+        try:
+            attrs = cups_conn.getJobAttributes(job_id, requested_attributes=JOB_ATTRIBUTES)
+        except cups.IPPError as e:
+            if e.args and e.args[0] != cups.IPP_NOT_FOUND:
+                raise
+            attrs = {}  # expurgado do CUPS: nada a gravar
+        if (attrs.get('job-state') or 9) < 7:
+            continue  # voltou para a fila entre as duas consultas
+        record = completed_record(job_id, attrs, page_totals, cutoff, tail_read_at, cycle)
+        if record is not None:
+            yield record
+
+    for chunk in iter_completed_jobs(cups_conn, checkpoint['watermark'] + 1, JOB_CHUNK_SIZE):
+        lowest_chunk = min(chunk)
+        if lowest_seen is None or lowest_chunk < lowest_seen:
+            lowest_seen = lowest_chunk
+        for job_id, attrs in chunk.items():
+            if job_settled(job_id) or job_id in pending:
+                continue
+            record = completed_record(job_id, attrs, page_totals, cutoff, tail_read_at, cycle)
+            if record is not None:
+                yield record
+    cycle['lowest_seen'] = lowest_seen
+
+def handle_sigterm(signum, frame):
+    # SystemExit sai do loop pelo finally, que grava o checkpoint do último commit
+    sys.exit(0)
+
+# ========== SNAPSHOT DE STATUS ==========
+def publish_status_snapshot(cursor, cups_conn, path=STATUS_SNAPSHOT):
+    """Publica o snapshot lido pelo quota_status.py (sem banco nem subprocesso)"""
+    try:
+        write_snapshot(collect_status(cursor, cups_conn), path)
+    except Exception as e:
+        logging.error(f"Erro ao publicar snapshot de status: {e}")
+
+# ========== CICLO ==========
+def job_record(job_id, attrs, page_totals):
+    """Campos do job usados na gravação (None se o CUPS ainda não informou a conclusão)"""
+    t = attrs.get('time-at-completed')
+    if not t:
+        return None
+    jid = str(job_id)
+    logged = pop_job_pages(page_totals, jid)
+    if logged is None:
+        pages = extract_pages(attrs)
+    else:
+        pages, complete = logged
+        if not complete:
+            # Parte das linhas ficou fora do tail: o log só serve de piso para o IPP
+            pages = max(pages, extract_pages(attrs))
+    return {
+        'job_id': job_id,
+        'jid': jid,
+        'printer': cups_to_printer_name(attrs.get('job-printer-uri', '')),
+        'user': attrs.get('job-originating-user-name') or 'UNKNOWN',
+        'title': attrs.get('job-name', ''),
+        'pages': pages,
+        'cost': extract_cost(attrs, pages),
+        'state': attrs.get('job-state'),
+        'completed_dt': datetime.fromtimestamp(int(t)),
+    }
+
+def store_job(cursor, record):
+    insert_or_update_job(cursor, record['jid'], record['printer'], record['user'], record['title'],
+                         record['pages'], record['completed_dt'], {'job-state': record['state']},
+                         record['cost'])
+
+def enforce_quotas(cursor, db, cups_conn, owns=None):
+    """Avalia as faixas de alerta e bloqueia quem esgotou a cota.
+
+    Os alertas só saem ao cruzar uma faixa; o bloqueio é verificado a cada ciclo, então
+    um cupsdisable que falhou ou uma fila reabilitada sem aumento de cota voltam a ser
+    bloqueados. owns(nome) restringe a verificação às impressoras deste processo (modo
+    com workers).
+    """
+    # Só retorna impressoras dentro de alguma faixa ou com nível a zerar
+    cursor.execute("""
+        SELECT name, monthly_quota, current_count, alert_level
+        FROM printers 
+        WHERE current_count >= monthly_quota * %s / 100
+           OR alert_level > 0
+    """, (ALERT_BANDS[0],))
+    
+    exhausted = []
+    for printer_info in cursor.fetchall():
+        printer_name = printer_info['name']
+        if owns is not None and not owns(printer_name):
+            continue
+        evaluate_alert_band(printer_name, printer_info['current_count'],
+                            printer_info['monthly_quota'], printer_info['alert_level'])
+        if printer_info['current_count'] >= printer_info['monthly_quota']:
+            exhausted.append(printer_info)
+
+    flush_alerts(cursor, db)
+
+    if exhausted:
+        # Só bloqueia filas que existem no CUPS e ainda não estão paradas
+        states = {name: attrs.get('printer-state') for name, attrs in cups_conn.getPrinters().items()}
+        for printer_info in exhausted:
+            state = states.get(printer_info['name'])
+            if state is None or state == CUPS_STOPPED:
+                continue
+            message = f"Cota esgotada: {printer_info['current_count']}/{printer_info['monthly_quota']}"
+            block_printer_job(printer_info['name'], message, cups_conn)
 
 # ========== MAIN LOOP ==========
-def main_loop():
-    # Inicializa impressoras no banco
-    initialize_printers_from_cups()
-    
-    cups_conn = cups.Connection()
+def main_loop(ha=False, cups_conn=None, checkpoint_path=MONITOR_CHECKPOINT, page_log_tail=PAGE_LOG_TAIL,
+              snapshot_path=STATUS_SNAPSHOT):
+    """Loop do monitor em um processo.
+
+    checkpoint_path None não lê nem grava checkpoint; page_log_tail False conta páginas
+    só pelos atributos IPP (ambos usados no replay, junto com outro snapshot_path).
+    """
+    setup_logging(LOG_FILE, LOG_LEVEL, LOG_JSON)
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    if ha:
+        resumed = start_as_leader(checkpoint_path=checkpoint_path)
+    else:
+        resumed = load_monitor_checkpoint(checkpoint_path)
+
+    cups_conn = cups_conn or cups.Connection()
     db = get_db_connection()
     cursor = db.cursor(dictionary=True)
 
-    cutoff = datetime.now() - timedelta(days=DAYS_TO_LOOK_BACK)
-    logging.info("Monitor com controle de cotas iniciado")
+    # Inicializa impressoras no banco
+    known_printers = sync_printers(cursor, cups_conn.getPrinters())
+    db.commit()
+    last_sync = time.monotonic()
+    load_alert_levels(cursor)
+
+    page_log_state = new_tail_state(PAGE_LOG_FILE) if page_log_tail else None
+    page_totals = {}
+
+    cutoff = datetime.fromtimestamp(source_time(cups_conn)) - timedelta(days=DAYS_TO_LOOK_BACK)
+    if resumed:
+        logging.info(f"Monitor com controle de cotas iniciado a partir do checkpoint "
+                     f"(job {checkpoint['watermark']}, concluído em {checkpoint['last_completed']})")
+    else:
+        logging.info("Monitor com controle de cotas iniciado")
 
     try:
         while True:
             try:
                 # -------- TEMPO REAL --------
-                jobs = cups_conn.getJobs(my_jobs=False, which_jobs='completed')
-                for job_id, attrs in jobs.items():
-                    t = attrs.get('time-at-completed')
-                    if not t:
-                        continue
-                    completed_dt = datetime.fromtimestamp(int(t))
-                    if completed_dt < cutoff:
-                        continue
-
-                    jid = str(job_id)
-                    printer = cups_to_printer_name(attrs.get('job-printer-uri', ''))
-                    user = attrs.get('job-originating-user-name') or 'UNKNOWN'
-                    title = attrs.get('job-name', '')
-                    pages = extract_pages(attrs)
-
-                    insert_or_update_job(cursor, db, jid, printer, user, title, pages, completed_dt, attrs)
+                cycle_started = time.monotonic()
+                if ha:
+                    renew_leadership()
+                cycle = {'settled': [], 'active': set(), 'lowest_seen': None}
+                last_completed = None
+                sync_needed = time.monotonic() - last_sync >= PRINTER_SYNC_INTERVAL
+                unknown_printers = set()
+                for record in read_cycle_jobs(cups_conn, page_log_state, page_totals, cutoff, cycle):
+                    cycle['settled'].append(record['job_id'])
+                    last_completed = max(last_completed or '', record['completed_dt'].isoformat())
+
+                    if record['printer'] not in known_printers:
+                        unknown_printers.add(record['printer'])
+                        sync_needed = True
+
+                    store_job(cursor, record)
+
+                # Antes do flush, para que o uso de filas novas já tenha linha em printers
+                if sync_needed:
+                    # Nomes que continuam desconhecidos não disparam nova sincronização até a periódica
+                    known_printers = sync_printers(cursor, cups_conn.getPrinters()) | unknown_printers
+                    last_sync = time.monotonic()
+                flush_batch(cursor, db)
+                advance_checkpoint(cycle['settled'], cycle['active'], cycle['lowest_seen'], last_completed)
+                save_monitor_checkpoint(checkpoint_path)
 
                 # # -------- HISTÓRICO --------
                 # hist_jobs = fetch_jobs_from_lpstat()
                 # for jid, printer, user, title, pages, completed_dt in hist_jobs:
                 #     if completed_dt < cutoff:
                 #         continue
-                #     insert_or_update_job(cursor, db, jid, printer, user, title, pages, completed_dt, attrs)
+                #     insert_or_update_job(cursor, jid, printer, user, title, pages, completed_dt, attrs)
 
                 # -------- VERIFICAÇÃO DE COTAS --------
                 if QUOTA_CHECK_ENABLED:
-                    cursor.execute("""
-                        SELECT name, monthly_quota, current_count
-                        FROM printers 
-                        WHERE current_count >= monthly_quota
-                    """)
-                    
-                    blocked_printers = cursor.fetchall()
-                    for printer_info in blocked_printers:
-                        printer_name = printer_info['name']
-                        message = f"Cota esgotada: {printer_info['current_count']}/{printer_info['monthly_quota']}"
-                        block_printer_job(printer_name, message)
+                    if ha:
+                        confirm_leadership()
+                    enforce_quotas(cursor, db, cups_conn)
 
-                time.sleep(CHECK_INTERVAL)
+                publish_status_snapshot(cursor, cups_conn, snapshot_path)
+                log_cycle_summary(cycle_started)
+
+                end_cycle(cups_conn, CHECK_INTERVAL)
 
             except Exception as e:
                 logging.exception("Erro no loop principal: %s", e)
+                discard_batch()
+                cycle_stats.clear()
                 try:
                     db.rollback()
                 except:
@@ -375,6 +819,11 @@ def main_loop():
                 time.sleep(CHECK_INTERVAL)
 
     finally:
+        save_monitor_checkpoint(checkpoint_path)
+        if ha:
+            step_down()
+        # Antes do atexit do log: as linhas da entrega final ainda chegam ao arquivo
+        notifications.stop()
         try:
             cursor.close()
             db.close()
@@ -382,26 +831,56 @@ def main_loop():
             pass
 
 # ========== UTILITÁRIOS CLI ==========
+# Comandos antigos deste script, atendidos pelo ponto de entrada único (printquota.py)
+LEGACY_COMMANDS = {"report": "quotas", "reset": "reset-month", "init": "init"}
+
+def run_monitor(args):
+    """Inicia o serviço: loop único ou, com --workers N, supervisor com N processos"""
+    import argparse
+    parser = argparse.ArgumentParser(prog="cups_monitor.py", description="Monitor de cotas do CUPS")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processos de gravação/aplicação, particionados por impressora")
+    parser.add_argument("--ha", action="store_true",
+                        help="ativo/passivo: só a instância que detém o lock no MySQL processa")
+    parser.add_argument("--record", metavar="DIR",
+                        help="grava as respostas do CUPS de cada ciclo em DIR")
+    parser.add_argument("--replay", metavar="DIR",
+                        help="processa uma gravação de DIR no lugar do CUPS")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="ritmo do replay em relação ao gravado (0 = sem esperas)")
+    options = parser.parse_args(args)
+    if options.replay and (options.record or options.ha):
+        parser.error("--replay não combina com --record nem com --ha")
+
+    cups_conn = None
+    paths = {}
+    if options.replay:
+        from job_source import ReplayConnection
+        # O replay sempre parte do início da gravação, não lê o page_log local e não
+        # sobrescreve o snapshot de produção
+        paths = {'checkpoint_path': None, 'page_log_tail': False,
+                 'snapshot_path': os.path.join(options.replay, "status.json")}
+        try:
+            cups_conn = ReplayConnection(options.replay, options.speed)
+        except FileNotFoundError as e:
+            parser.error(str(e))
+    elif options.record:
+        from job_source import RecordingConnection
+        cups_conn = RecordingConnection(cups.Connection(), options.record)
+
+    if options.workers > 1:
+        from monitor_shards import run_sharded
+        run_sharded(options.workers, options.ha, cups_conn, **paths)
+    else:
+        main_loop(options.ha, cups_conn, **paths)
+
 def main():
-    import sys
-    
-    if len(sys.argv) > 1:
-        command = sys.argv[1]
-        
-        if command == "report":
-            generate_quota_report()
-        elif command == "reset":
-            reset_monthly_quotas()
-        elif command == "init":
-            initialize_printers_from_cups()
-            print("Impressoras inicializadas no sistema")
-        else:
-            print("Comandos disponíveis:")
-            print("  python3 script.py report  - Relatório de cotas")
-            print("  python3 script.py reset   - Reset cotas mensais")
-            print("  python3 script.py init    - Inicializar impressoras")
+    if len(sys.argv) > 1 and not sys.argv[1].startswith("-"):
+        from printquota import main as printquota_main
+        command = LEGACY_COMMANDS.get(sys.argv[1], sys.argv[1])
+        sys.exit(printquota_main([command] + sys.argv[2:]))
     else:
-        main_loop()
+        run_monitor(sys.argv[1:])
 
 if __name__ == "__main__":
-    main()
+    main()
\ No newline at end of file
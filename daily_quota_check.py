@@ -1,6 +1,5 @@
 #!/opt/cups_monitor_env/bin/python3
 import mysql.connector
-import subprocess
 import logging
 from datetime import datetime
 from dotenv import load_dotenv
@@ -14,84 +13,119 @@ MYSQL_USER = os.getenv("MYSQL_USER")
 MYSQL_PASS = os.getenv("MYSQL_PASS")
 MYSQL_DB   = os.getenv("MYSQL_DB")
 
+WARNING_PERCENT = 90  # Faixa de alerta da verificação diária
+ALERT_SUFFIX = "% da cota mensal"
+CUPS_STOPPED = 5      # printer-state "parada"
+
 logging.basicConfig(
     filename="/var/log/daily_quota.log",
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(message)s"
 )
 
-def daily_quota_check():
-    """Verificação diária das cotas"""
+# Um alerta por impressora, tipo e dia: rodar a verificação de novo não duplica.
+# O sufixo com "%" vai como parâmetro: com parâmetros nomeados o conector não
+# converte "%%" em "%" dentro de literais. Cota 0 não tem percentual (e o CONCAT
+# com NULL anularia a mensagem), então essas impressoras ficam de fora.
+DAILY_ALERTS_SQL = """
+    INSERT INTO quota_alerts (printer_name, alert_type, current_usage, quota_limit, message)
+    SELECT p.name, %(alert_type)s, p.current_count, p.monthly_quota,
+           CONCAT(%(prefix)s, ROUND(p.current_count * 100 / p.monthly_quota, 1), %(suffix)s)
+    FROM printers p
+    WHERE p.removed_at IS NULL AND p.monthly_quota > 0 AND {condition}
+      AND NOT EXISTS (
+          SELECT 1 FROM quota_alerts a
+          WHERE a.printer_name = p.name AND a.alert_type = %(alert_type)s
+            AND a.created_at >= CURDATE()
+      )
+"""
+
+def insert_daily_alerts(cursor):
+    """Registra os alertas do dia em duas instruções; retorna (esgotadas, em alerta) inseridos"""
+    cursor.execute(DAILY_ALERTS_SQL.format(condition="p.current_count >= p.monthly_quota"),
+                   {'alert_type': 'QUOTA_EXCEEDED', 'prefix': 'Verificação diária - Cota esgotada: ',
+                    'suffix': ALERT_SUFFIX})
+    exceeded = cursor.rowcount
+    cursor.execute(DAILY_ALERTS_SQL.format(
+                       condition="p.current_count >= p.monthly_quota * %(percent)s / 100 "
+                                 "AND p.current_count < p.monthly_quota"),
+                   {'alert_type': 'WARNING', 'prefix': 'Uso em ', 'suffix': ALERT_SUFFIX,
+                    'percent': WARNING_PERCENT})
+    return exceeded, cursor.rowcount
+
+def disable_printers(names):
+    """Bloqueia via IPP, em uma passada, as filas que ainda não estão paradas"""
+    import cups
+    conn = cups.Connection()
+    printers = conn.getPrinters()
+    disabled = []
+    for name in names:
+        if name not in printers or printers[name].get('printer-state') == CUPS_STOPPED:
+            continue
+        try:
+            conn.disablePrinter(name)
+            disabled.append(name)
+        except cups.IPPError as e:
+            logging.error(f"Erro ao bloquear {name}: {e}")
+    return disabled
+
+def daily_quota_check(db=None):
+    """Verificação diária das cotas (reaproveita a conexão recebida, se houver)"""
+    own_db = db is None
     try:
-        db = mysql.connector.connect(
-            host=MYSQL_HOST,
-            user=MYSQL_USER,
-            password=MYSQL_PASS,
-            database=MYSQL_DB
-        )
+        if own_db:
+            db = mysql.connector.connect(
+                host=MYSQL_HOST,
+                user=MYSQL_USER,
+                password=MYSQL_PASS,
+                database=MYSQL_DB
+            )
         cursor = db.cursor(dictionary=True)
         
-        # Verificar impressoras com cota excedida
-        cursor.execute("""
-            SELECT name, current_count, monthly_quota
-            FROM printers 
-            WHERE current_count >= monthly_quota
-        """)
-        
-        blocked_printers = cursor.fetchall()
-        for printer in blocked_printers:
-            try:
-                # Bloquear impressora
-                subprocess.run(['cupsdisable', printer['name']], check=True)
-                logging.warning(f"Impressora {printer['name']} bloqueada - Cota esgotada: {printer['current_count']}/{printer['monthly_quota']}")
-                
-                # Registrar alerta
-                cursor.execute("""
-                    INSERT INTO quota_alerts (printer_name, alert_type, current_usage, quota_limit, message)
-                    VALUES (%s, 'QUOTA_EXCEEDED', %s, %s, %s)
-                """, (printer['name'], printer['current_count'], printer['monthly_quota'], 
-                     f"Verificação diária - Cota esgotada"))
-                
-            except Exception as e:
-                logging.error(f"Erro ao bloquear {printer['name']}: {e}")
-        
-        # Verificar impressoras próximas ao limite (90%)
+        # Impressoras esgotadas e próximas do limite em uma única consulta
         cursor.execute("""
             SELECT name, current_count, monthly_quota,
                    ROUND((current_count / monthly_quota) * 100, 1) as usage_percent
             FROM printers 
-            WHERE (current_count / monthly_quota) >= 0.9 
-            AND current_count < monthly_quota
-        """)
-        
-        warning_printers = cursor.fetchall()
-        for printer in warning_printers:
-            logging.warning(f"ALERTA: {printer['name']} em {printer['usage_percent']}% da cota ({printer['current_count']}/{printer['monthly_quota']})")
-            
-            # Registrar alerta apenas uma vez por dia
-            cursor.execute("""
-                SELECT id FROM quota_alerts 
-                WHERE printer_name = %s 
-                AND alert_type = 'WARNING' 
-                AND DATE(created_at) = CURDATE()
-            """, (printer['name'],))
-            
-            if not cursor.fetchone():
-                cursor.execute("""
-                    INSERT INTO quota_alerts (printer_name, alert_type, current_usage, quota_limit, message)
-                    VALUES (%s, 'WARNING', %s, %s, %s)
-                """, (printer['name'], printer['current_count'], printer['monthly_quota'], 
-                     f"Uso em {printer['usage_percent']}% da cota mensal"))
+            WHERE removed_at IS NULL AND monthly_quota > 0
+              AND current_count >= monthly_quota * %s / 100
+        """, (WARNING_PERCENT,))
         
+        blocked_printers = []
+        warning_printers = []
+        for printer in cursor.fetchall():
+            if printer['current_count'] >= printer['monthly_quota']:
+                blocked_printers.append(printer)
+            else:
+                warning_printers.append(printer)
+                logging.warning(f"ALERTA: {printer['name']} em {printer['usage_percent']}% da cota "
+                                f"({printer['current_count']}/{printer['monthly_quota']})")
+
+        exceeded_alerts, warning_alerts = insert_daily_alerts(cursor)
         db.commit()
-        logging.info(f"Verificação concluída - {len(blocked_printers)} bloqueadas, {len(warning_printers)} em alerta")
+
+        # Bloquear impressoras
+        if blocked_printers:
+            try:
+                disabled = set(disable_printers([p['name'] for p in blocked_printers]))
+            except Exception as e:
+                logging.error(f"Erro ao consultar o CUPS: {e}")
+                disabled = set()
+            for printer in blocked_printers:
+                if printer['name'] in disabled:
+                    logging.warning(f"Impressora {printer['name']} bloqueada - Cota esgotada: "
+                                    f"{printer['current_count']}/{printer['monthly_quota']}")
+        
+        logging.info(f"Verificação concluída - {len(blocked_printers)} esgotadas, "
+                     f"{len(warning_printers)} em alerta, {exceeded_alerts + warning_alerts} alertas novos")
         
     except Exception as e:
         logging.error(f"Erro na verificação diária: {e}")
     finally:
         try:
             cursor.close()
-            db.close()
+            if own_db:
+                db.close()
         except:
             pass
 
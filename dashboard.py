@@ -0,0 +1,254 @@
+#!/opt/cups_monitor_env/bin/python3
+import sys
+import json
+import hashlib
+import html
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from dotenv import load_dotenv
+import os
+
+from quota_status import load_snapshot, collect_status
+
+# Carregar variáveis do .env
+load_dotenv("/opt/cups_monitor_env/.env")
+
+MYSQL_HOST = os.getenv("MYSQL_HOST")
+MYSQL_USER = os.getenv("MYSQL_USER")
+MYSQL_PASS = os.getenv("MYSQL_PASS")
+MYSQL_DB   = os.getenv("MYSQL_DB")
+
+# Sem autenticação e com nomes de usuários: por padrão só atende a máquina local.
+# Para expor na rede, defina DASHBOARD_HOST no .env (ou passe o host) atrás de um proxy com acesso controlado.
+DASHBOARD_HOST = os.getenv("DASHBOARD_HOST", "127.0.0.1")
+DASHBOARD_PORT = 8080
+CACHE_TTL = 15          # segundos que uma resposta fica em memória
+SNAPSHOT_MAX_AGE = 300  # snapshot do monitor mais velho que isso cai para o banco
+TOP_USERS_DAYS = (1, 7, 30)
+
+logging.basicConfig(
+    filename="/var/log/quota_dashboard.log",
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+# ========== BANCO ==========
+# Uma conexão para o servidor inteiro: o cache garante no máximo uma consulta
+# por recurso a cada CACHE_TTL, então não há concorrência a atender no MySQL.
+_db = None
+_db_lock = threading.Lock()
+
+def query(fn, *args):
+    """Executa fn(cursor, *args) na conexão compartilhada, reconectando se preciso"""
+    global _db
+    import mysql.connector
+    with _db_lock:
+        for attempt in range(2):
+            try:
+                if _db is None or not _db.is_connected():
+                    _db = mysql.connector.connect(
+                        host=MYSQL_HOST,
+                        user=MYSQL_USER,
+                        password=MYSQL_PASS,
+                        database=MYSQL_DB,
+                        autocommit=True
+                    )
+                cursor = _db.cursor(dictionary=True)
+                try:
+                    return fn(cursor, *args)
+                finally:
+                    cursor.close()
+            except mysql.connector.Error:
+                _db = None
+                if attempt:
+                    raise
+
+# ========== DADOS ==========
+def current_status():
+    """Status do snapshot publicado pelo monitor; consulta o banco só se ele estiver velho"""
+    status = load_snapshot(ttl=SNAPSHOT_MAX_AGE)
+    if status is None:
+        status = query(collect_status)
+    return status
+
+def printers_data():
+    status = current_status()
+    return {'generated_at': status['generated_at'], 'printers': status['printers']}
+
+def alerts_data():
+    status = current_status()
+    return {'generated_at': status['generated_at'], 'alerts': status['alerts']}
+
+def top_users_data(days, limit=20):
+    from usage_rollup import usage_by
+    until = date.today()
+    since = until - timedelta(days=days - 1)
+    rows = query(usage_by, 'user', since, until, limit)
+    return {
+        'generated_at': time.time(),
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'users': [{'user': r['user'], 'jobs': int(r['jobs']), 'pages': int(r['pages']),
+                   'cost': int(r['cost'])} for r in rows],
+    }
+
+# ========== CACHE ==========
+_cache = {}
+_cache_lock = threading.Lock()
+_key_locks = {}
+
+def cached(key, build):
+    """Resposta (etag, corpo, content-type) do cache; recalcula uma vez por TTL.
+
+    Requisições simultâneas pela mesma chave esperam o primeiro cálculo em vez de
+    repetirem a consulta.
+    """
+    entry = _cache.get(key)
+    if entry and entry[0] > time.monotonic():
+        return entry[1:]
+    with _cache_lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        entry = _cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1:]
+        body, content_type = build()
+        etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+        _cache[key] = (time.monotonic() + CACHE_TTL, etag, body, content_type)
+        return etag, body, content_type
+
+def json_response(data):
+    return json.dumps(data, ensure_ascii=False, default=str).encode("utf-8"), "application/json; charset=utf-8"
+
+# ========== HTML ==========
+def render_page(days):
+    status = current_status()
+    users = top_users_data(days)['users']
+    generated = datetime.fromtimestamp(status['generated_at']).strftime('%d/%m/%Y %H:%M:%S')
+    esc = html.escape
+
+    rows = []
+    for p in status['printers']:
+        rows.append(f"<tr><td>{esc(p['name'])}</td><td>{p['current_count']}/{p['monthly_quota']}</td>"
+                    f"<td>{p['usage_percent']:.1f}%</td><td>{esc(str(p.get('cups_state', '?')))}</td>"
+                    f"<td>{p.get('queued_jobs', '?')}</td></tr>")
+    user_rows = [f"<tr><td>{esc(u['user'])}</td><td>{u['jobs']}</td><td>{u['pages']}</td>"
+                 f"<td>{u['cost']}</td></tr>" for u in users]
+    alert_rows = [f"<tr><td>{esc(a['created_at'])}</td><td>{esc(a['printer_name'])}</td>"
+                  f"<td>{esc(a['alert_type'])}</td><td>{a['current_usage']}/{a['quota_limit']}</td></tr>"
+                  for a in status['alerts']]
+    links = " | ".join(f'<a href="/?days={d}">{d} dia(s)</a>' for d in TOP_USERS_DAYS)
+
+    page = f"""<!DOCTYPE html>
+<html lang="pt-BR"><head><meta charset="utf-8">
+<meta http-equiv="refresh" content="60">
+<title>Cotas de impressão</title>
+<style>body{{font-family:sans-serif;margin:2em}}table{{border-collapse:collapse;margin-bottom:2em}}
+td,th{{border:1px solid #ccc;padding:4px 8px;text-align:left}}</style></head><body>
+<h1>Cotas de impressão</h1><p>Atualizado em {generated}</p>
+<h2>Impressoras</h2>
+<table><tr><th>Impressora</th><th>Uso/Cota</th><th>%</th><th>CUPS</th><th>Fila</th></tr>
+{"".join(rows)}</table>
+<h2>Top usuários ({days} dia(s))</h2><p>{links}</p>
+<table><tr><th>Usuário</th><th>Jobs</th><th>Páginas</th><th>Custo</th></tr>
+{"".join(user_rows)}</table>
+<h2>Alertas recentes</h2>
+<table><tr><th>Data</th><th>Impressora</th><th>Tipo</th><th>Uso/Cota</th></tr>
+{"".join(alert_rows)}</table>
+</body></html>
+"""
+    return page.encode("utf-8"), "text/html; charset=utf-8"
+
+# ========== SERVIDOR ==========
+def parse_days(params):
+    try:
+        days = int(params.get('days', ['7'])[0])
+    except ValueError:
+        return None
+    return days if days in TOP_USERS_DAYS else None
+
+def resolve(path, params):
+    """Mapeia a rota para (chave de cache, função que monta a resposta)"""
+    if path == "/api/printers":
+        return path, lambda: json_response(printers_data())
+    if path == "/api/alerts":
+        return path, lambda: json_response(alerts_data())
+    if path in ("/api/top-users", "/"):
+        days = parse_days(params)
+        if days is None:
+            return None
+        if path == "/":
+            return f"/?days={days}", lambda: render_page(days)
+        return f"{path}?days={days}", lambda: json_response(top_users_data(days))
+    return None
+
+def etag_matches(header, etag):
+    """If-None-Match: lista de entity-tags separadas por vírgula ou '*' (comparação fraca)"""
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+class DashboardHandler(BaseHTTPRequestHandler):
+    server_version = "QuotaDashboard/1.0"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        route = resolve(url.path, parse_qs(url.query))
+        if route is None:
+            self.send_error(404)
+            return
+        try:
+            etag, body, content_type = cached(*route)
+        except Exception as e:
+            logging.error(f"Erro ao montar {url.path}: {e}")
+            self.send_error(503)
+            return
+
+        if etag_matches(self.headers.get("If-None-Match"), etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", f"max-age={CACHE_TTL}")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", f"max-age={CACHE_TTL}")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+def serve(host=DASHBOARD_HOST, port=DASHBOARD_PORT):
+    server = ThreadingHTTPServer((host, port), DashboardHandler)
+    server.daemon_threads = True
+    logging.info(f"Painel em http://{host}:{port}/")
+    print(f"Painel em http://{host}:{port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DASHBOARD_PORT
+    host = sys.argv[2] if len(sys.argv) > 2 else DASHBOARD_HOST
+    serve(host, port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/opt/cups_monitor_env/bin/python3
+import mysql.connector
+import argparse
+import csv
+import gzip
+import io
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+import os
+
+# Carregar variáveis do .env
+load_dotenv("/opt/cups_monitor_env/.env")
+
+MYSQL_HOST = os.getenv("MYSQL_HOST")
+MYSQL_USER = os.getenv("MYSQL_USER")
+MYSQL_PASS = os.getenv("MYSQL_PASS")
+MYSQL_DB   = os.getenv("MYSQL_DB")
+
+FETCH_SIZE = 5000  # Linhas por fetchmany (limita a memória do export)
+
+EXPORT_COLUMNS = "job_id, printer, user, title, pages, weighted_pages, completed_at, created_at"
+
+# ========== STREAMING ==========
+def open_output(path, compress):
+    """Abre o destino em modo texto; '-' é a saída padrão"""
+    if path == '-':
+        if compress:
+            return io.TextIOWrapper(gzip.GzipFile(fileobj=sys.stdout.buffer, mode='wb'),
+                                    encoding='utf-8', newline='')
+        return io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', newline='')
+    if compress:
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+def close_cursor(cursor, db):
+    """Fecha um cursor não bufferizado que pode ter linhas não lidas, sem levantar erro"""
+    try:
+        cursor.close()
+    except Exception:
+        # "Unread result found": descarta o resto do resultado para liberar a conexão
+        try:
+            db.consume_results()
+            cursor.close()
+        except Exception:
+            pass
+
+def export_query(db, query, params, path, fmt='csv', compress=False, fetch_size=FETCH_SIZE):
+    """Executa a consulta com cursor não bufferizado e grava em CSV/JSONL aos blocos.
+
+    Em arquivo, grava em .tmp e renomeia no final (nunca deixa export pela metade);
+    se falhar no meio, o .tmp é removido e o erro original é repassado.
+    Retorna o número de linhas exportadas.
+    """
+    target = path if path == '-' else path + '.tmp'
+    cursor = db.cursor(buffered=False)
+    rows = 0
+    try:
+        cursor.execute(query, params)
+        columns = cursor.column_names
+        out = open_output(target, compress)
+        try:
+            if fmt == 'csv':
+                writer = csv.writer(out)
+                writer.writerow(columns)
+            while True:
+                chunk = cursor.fetchmany(fetch_size)
+                if not chunk:
+                    break
+                if fmt == 'csv':
+                    writer.writerows(chunk)
+                else:
+                    for row in chunk:
+                        out.write(json.dumps(dict(zip(columns, row)), default=str, ensure_ascii=False))
+                        out.write("\n")
+                rows += len(chunk)
+        finally:
+            if path == '-' and not compress:
+                out.flush()
+                out.detach()  # não fecha o stdout
+            else:
+                out.close()
+    except BaseException:
+        close_cursor(cursor, db)
+        if path != '-':
+            try:
+                os.remove(target)
+            except OSError:
+                pass
+        raise
+    cursor.close()
+
+    if path != '-':
+        os.replace(target, path)
+    return rows
+
+def build_job_query(since=None, until=None, printer=None, user=None):
+    """SELECT de print_jobs com filtros; período em intervalo semiaberto (poda partições)"""
+    where = []
+    params = []
+    if since:
+        where.append("completed_at >= %s")
+        params.append(since)
+    if until:
+        where.append("completed_at < %s")
+        params.append(until + timedelta(days=1))
+    if printer:
+        where.append("printer = %s")
+        params.append(printer)
+    if user:
+        where.append("user = %s")
+        params.append(user)
+    query = f"SELECT {EXPORT_COLUMNS} FROM print_jobs"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    return query, tuple(params)
+
+def parse_day(value):
+    return datetime.strptime(value, "%Y-%m-%d")
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta print_jobs em streaming para CSV ou JSONL")
+    parser.add_argument("--from", dest="since", type=parse_day, help="Data inicial (AAAA-MM-DD)")
+    parser.add_argument("--to", dest="until", type=parse_day, help="Data final, inclusiva (AAAA-MM-DD)")
+    parser.add_argument("--printer", help="Filtra por impressora")
+    parser.add_argument("--user", help="Filtra por usuário")
+    parser.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    parser.add_argument("--gzip", action="store_true", help="Comprime a saída com gzip")
+    parser.add_argument("-o", "--output", default="-", help="Arquivo de saída ('-' para stdout)")
+    args = parser.parse_args()
+
+    compress = args.gzip or args.output.endswith(".gz")
+    query, params = build_job_query(args.since, args.until, args.printer, args.user)
+
+    try:
+        db = mysql.connector.connect(
+            host=MYSQL_HOST,
+            user=MYSQL_USER,
+            password=MYSQL_PASS,
+            database=MYSQL_DB
+        )
+        started = time.monotonic()
+        rows = export_query(db, query, params, args.output, args.format, compress)
+        elapsed = time.monotonic() - started
+
+        # Relatório de vazão vai para stderr para não misturar com o export em stdout
+        rate = rows / elapsed if elapsed > 0 else 0
+        print(f"{rows} jobs exportados em {elapsed:.1f}s ({rate:,.0f} jobs/s)", file=sys.stderr)
+        return 0
+
+    except Exception as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    finally:
+        try:
+            db.close()
+        except:
+            pass
+
+if __name__ == "__main__":
+    sys.exit(main())
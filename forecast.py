@@ -0,0 +1,165 @@
+#!/opt/cups_monitor_env/bin/python3
+import mysql.connector
+import sys
+import time
+from calendar import monthrange
+from datetime import date
+from dotenv import load_dotenv
+import os
+
+# Carregar variáveis do .env
+load_dotenv("/opt/cups_monitor_env/.env")
+
+MYSQL_HOST = os.getenv("MYSQL_HOST")
+MYSQL_USER = os.getenv("MYSQL_USER")
+MYSQL_PASS = os.getenv("MYSQL_PASS")
+MYSQL_DB   = os.getenv("MYSQL_DB")
+
+# ========== AJUSTE ==========
+def fetch_curves(cursor, key, today):
+    """Somatórios do mês por impressora/usuário, lidos do rollup em uma única consulta.
+
+    Os dias já encerrados (antes de hoje) entram no ajuste; o total inclui hoje.
+    Dias sem linha no rollup valem zero, então só Σy e Σxy vêm do banco.
+    """
+    if key not in ('printer', 'user'):
+        raise ValueError(f"Agrupamento inválido: {key}")
+    cursor.execute(f"""
+        SELECT {key} AS name,
+               SUM(CASE WHEN day < %s THEN weighted_pages ELSE 0 END) AS sum_y,
+               SUM(CASE WHEN day < %s THEN DAY(day) * weighted_pages ELSE 0 END) AS sum_xy,
+               SUM(weighted_pages) AS month_total
+        FROM print_usage_daily
+        WHERE day BETWEEN %s AND %s
+        GROUP BY {key}
+    """, (today, today, today.replace(day=1), today))
+    return {row['name']: row for row in cursor.fetchall()}
+
+def fit_line(sum_y, sum_xy, days):
+    """Mínimos quadrados de uso diário x dia do mês, na forma fechada.
+
+    Σx e Σx² dos dias 1..days são iguais para todos, então o ajuste de toda a frota
+    sai dos somatórios agregados no banco, sem percorrer dia a dia.
+    """
+    if days < 1:
+        return 0.0, 0.0
+    sum_x = days * (days + 1) / 2
+    sum_x2 = days * (days + 1) * (2 * days + 1) / 6
+    denominator = days * sum_x2 - sum_x * sum_x
+    if denominator == 0:
+        return float(sum_y) / days, 0.0
+    slope = (days * sum_xy - sum_x * sum_y) / denominator
+    intercept = (sum_y - slope * sum_x) / days
+    return intercept, slope
+
+def project(base, intercept, slope, today, quota=None):
+    """Projeta o uso dos dias restantes; retorna (total no fim do mês, data de esgotamento)"""
+    last_day = monthrange(today.year, today.month)[1]
+    total = float(base)
+    exhausted = today if quota and total >= quota else None
+    for day in range(today.day + 1, last_day + 1):
+        total += max(0.0, intercept + slope * day)
+        if quota and exhausted is None and total >= quota:
+            exhausted = today.replace(day=day)
+    return round(total), exhausted
+
+def forecast_printers(cursor, today=None):
+    """Previsão por impressora: total projetado e data em que a cota se esgota"""
+    today = today or date.today()
+    curves = fetch_curves(cursor, 'printer', today)
+    cursor.execute("SELECT name, monthly_quota, current_count FROM printers")
+
+    results = []
+    for row in cursor.fetchall():
+        curve = curves.get(row['name'])
+        intercept, slope = 0.0, 0.0
+        if curve:
+            intercept, slope = fit_line(float(curve['sum_y']), float(curve['sum_xy']), today.day - 1)
+        # A base é o contador de cota, o mesmo número usado no bloqueio
+        projected, exhausted = project(row['current_count'], intercept, slope, today, row['monthly_quota'])
+        results.append({
+            'name': row['name'],
+            'monthly_quota': row['monthly_quota'],
+            'current_count': row['current_count'],
+            'projected': projected,
+            'projected_percent': projected * 100 / row['monthly_quota'] if row['monthly_quota'] else 0,
+            'exhausted_on': exhausted,
+        })
+    results.sort(key=lambda r: (r['exhausted_on'] or date.max, -r['projected_percent']))
+    return results
+
+def forecast_users(cursor, today=None):
+    """Previsão por usuário: total projetado no fim do mês (usuários não têm cota)"""
+    today = today or date.today()
+    results = []
+    for name, curve in fetch_curves(cursor, 'user', today).items():
+        intercept, slope = fit_line(float(curve['sum_y']), float(curve['sum_xy']), today.day - 1)
+        projected, _ = project(curve['month_total'], intercept, slope, today)
+        results.append({'name': name, 'current_count': int(curve['month_total']), 'projected': projected})
+    results.sort(key=lambda r: -r['projected'])
+    return results
+
+# ========== RELATÓRIO ==========
+def forecast_lines(printers, limit=None):
+    """Linhas da seção de previsão (impressoras que esgotam a cota antes do fim do mês)"""
+    lines = []
+    at_risk = [p for p in printers if p['exhausted_on']]
+    for p in at_risk[:limit]:
+        lines.append(f"{p['name']:<20} {p['current_count']:>5}/{p['monthly_quota']:<5} -> "
+                     f"{p['projected']:>5} ({p['projected_percent']:>5.1f}%) "
+                     f"esgota em {p['exhausted_on'].strftime('%d/%m')}")
+    return lines
+
+def main():
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    target = sys.argv[1] if len(sys.argv) > 1 else "all"
+    if target not in ("all", "printers", "users"):
+        print("Uso:")
+        print("  python3 forecast.py [all|printers|users] [LIMITE]   - Previsão de fim de mês")
+        return
+
+    try:
+        db = mysql.connector.connect(
+            host=MYSQL_HOST,
+            user=MYSQL_USER,
+            password=MYSQL_PASS,
+            database=MYSQL_DB
+        )
+        cursor = db.cursor(dictionary=True)
+
+        started = time.monotonic()
+        print("\n" + "="*80)
+        print(f"PREVISÃO DE USO - FIM DE {date.today().strftime('%m/%Y')}")
+        print("="*80)
+
+        if target in ("all", "printers"):
+            printers = forecast_printers(cursor)
+            print(f"{'IMPRESSORA':<20} {'USO/COTA':<12} {'PROJETADO':<17} ESGOTAMENTO")
+            print("-"*80)
+            for p in printers[:limit]:
+                exhausted = p['exhausted_on'].strftime('%d/%m') if p['exhausted_on'] else "-"
+                print(f"{p['name']:<20} {p['current_count']:>5}/{p['monthly_quota']:<6} "
+                      f"{p['projected']:>6} ({p['projected_percent']:>5.1f}%)  {exhausted}")
+            print()
+
+        if target in ("all", "users"):
+            print(f"{'USUÁRIO':<25} {'NO MÊS':>8} {'PROJETADO':>10}")
+            print("-"*80)
+            for u in forecast_users(cursor)[:limit]:
+                print(f"{u['name']:<25} {u['current_count']:>8} {u['projected']:>10}")
+            print()
+
+        print(f"Calculado em {time.monotonic() - started:.2f}s")
+        print("="*80)
+
+    except Exception as e:
+        print(f"Erro: {e}")
+    finally:
+        try:
+            cursor.close()
+            db.close()
+        except:
+            pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+# Leitura dos jobs concluídos do CUPS em blocos de tamanho fixo.
+#
+# getJobs(which_jobs='completed') sem limite devolve, em um único dict, todo o
+# histórico retido (PreserveJobHistory) com todos os atributos. Aqui o histórico é
+# percorrido com first_job_id + limit, pedindo só os atributos usados pelo monitor,
+# e cada bloco é processado antes de o próximo ser buscado. O mesmo módulo grava e
+# reproduz as respostas do CUPS (--record/--replay do monitor).
+import glob
+import gzip
+import json
+import logging
+import os
+import time
+
+# Atributos lidos por job_record(), extract_pages() e extract_cost()
+JOB_ATTRIBUTES = [
+    'job-id',
+    'job-printer-uri',
+    'job-originating-user-name',
+    'job-name',
+    'job-state',
+    'time-at-completed',
+    'job-media-sheets-completed',
+    'job-pages-completed',
+    'job-impressions-completed',
+    'print-color-mode',
+    'sides',
+    'media',
+]
+
+def iter_completed_jobs(cups_conn, first_job_id=1, chunk_size=500, attributes=JOB_ATTRIBUTES):
+    """Gera blocos ({job_id: atributos}) dos jobs concluídos a partir de first_job_id.
+
+    chunk_size 0 busca tudo em uma chamada (comportamento antigo).
+    """
+    if not chunk_size:
+        yield cups_conn.getJobs(my_jobs=False, which_jobs='completed', requested_attributes=attributes)
+        return
+
+    while True:
+        chunk = cups_conn.getJobs(my_jobs=False, which_jobs='completed', first_job_id=first_job_id,
+                                  limit=chunk_size, requested_attributes=attributes)
+        if not chunk:
+            return
+        next_job_id = max(chunk) + 1
+        full = len(chunk) >= chunk_size
+        yield chunk
+        del chunk
+        if not full:
+            return
+        first_job_id = next_job_id
+
+# ========== GRAVAÇÃO E REPLAY ==========
+# --record DIR grava, por ciclo, uma linha JSON (gzip) com o que o CUPS respondeu:
+# jobs concluídos e ativos vistos no ciclo e, quando mudam, as impressoras. --replay DIR
+# responde getJobs/getPrinters a partir dessas linhas, no ritmo gravado (ou acelerado),
+# para reproduzir o tráfego de produção contra qualquer banco. No replay os bloqueios
+# passam pela conexão (block_printer) e ficam só no log: nada de cupsdisable/cancel
+# nem notificações.
+RECORD_PATTERN = "cycles-*.jsonl.gz"
+
+def _merge_jobs(target, jobs):
+    for job_id, attrs in jobs.items():
+        target.setdefault(job_id, {}).update(attrs)
+
+class RecordingConnection:
+    """Repassa as chamadas ao CUPS real e grava as respostas de cada ciclo"""
+
+    def __init__(self, cups_conn, directory):
+        self._conn = cups_conn
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, time.strftime("cycles-%Y%m%d-%H%M%S.jsonl.gz"))
+        self._last_printers = None
+        self._new_cycle()
+        logging.info(f"Gravando as respostas do CUPS em {self.path}")
+
+    def _new_cycle(self):
+        self._cycle = {'t': time.time(), 'completed': {}, 'active': {}}
+
+    def getJobs(self, **kwargs):
+        jobs = self._conn.getJobs(**kwargs)
+        key = 'completed' if kwargs.get('which_jobs') == 'completed' else 'active'
+        _merge_jobs(self._cycle[key], jobs)
+        return jobs
+
+    def getJobAttributes(self, job_id, **kwargs):
+        attrs = self._conn.getJobAttributes(job_id, **kwargs)
+        key = 'completed' if (attrs.get('job-state') or 0) >= 7 else 'active'
+        _merge_jobs(self._cycle[key], {job_id: attrs})
+        return attrs
+
+    def getPrinters(self):
+        printers = self._conn.getPrinters()
+        if printers != self._last_printers:
+            self._cycle['printers'] = printers
+            self._last_printers = printers
+        return printers
+
+    def end_cycle(self, interval):
+        """Grava o ciclo como um membro gzip completo: uma queda perde no máximo o ciclo corrente"""
+        try:
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(self._cycle, separators=(',', ':'), default=str) + "\n")
+        except Exception as e:
+            logging.error(f"Erro ao gravar o ciclo em {self.path}: {e}")
+        time.sleep(interval)
+        self._new_cycle()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+def load_recording(directory):
+    """Gera os ciclos gravados em DIR, em ordem, com os job ids de volta a int"""
+    paths = sorted(glob.glob(os.path.join(directory, RECORD_PATTERN)))
+    if not paths:
+        raise FileNotFoundError(f"Nenhuma gravação ({RECORD_PATTERN}) em {directory}")
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    try:
+                        cycle = json.loads(line)
+                    except ValueError:
+                        logging.warning(f"Linha inválida ignorada em {path}")
+                        continue
+                    for key in ('completed', 'active'):
+                        cycle[key] = {int(job_id): attrs for job_id, attrs in cycle[key].items()}
+                    yield cycle
+            except EOFError:
+                # Gravação interrompida no meio de um ciclo
+                logging.warning(f"Fim truncado ignorado em {path}")
+
+class DryRunConnection:
+    """Conexão sem efeito no CUPS: devolve os estados de fila recebidos e só registra bloqueios.
+
+    É a conexão dos workers no replay (o supervisor envia as impressoras a cada ciclo).
+    """
+
+    def __init__(self, printers=None):
+        self._printers = printers or {}
+
+    def getPrinters(self):
+        return self._printers
+
+    def set_printers(self, printers):
+        self._printers = printers
+
+    def block_printer(self, printer_name, reason):
+        """Registra o bloqueio que seria aplicado e marca a fila como parada até a próxima leitura"""
+        logging.warning(f"REPLAY: bloqueio não aplicado a {printer_name} - {reason}")
+        if printer_name in self._printers:
+            self._printers = dict(self._printers)
+            self._printers[printer_name] = dict(self._printers[printer_name], **{'printer-state': 5})
+
+class ReplayConnection(DryRunConnection):
+    """Substitui cups.Connection respondendo com os ciclos gravados.
+
+    speed multiplica o ritmo original (2 = duas vezes mais rápido); 0 não espera entre ciclos.
+    Ao fim da gravação, encerra o monitor com SystemExit (o finally do loop fecha tudo).
+    """
+
+    def __init__(self, directory, speed=1.0):
+        self.directory = directory
+        self.speed = speed
+        self._cycles = load_recording(directory)
+        super().__init__()
+        self.replayed = 0
+        self._started = time.monotonic()
+        self._cycle = None
+        self._advance()
+        logging.info(f"Replay de {directory} (velocidade {speed or 'máxima'})")
+
+    def _advance(self):
+        cycle = next(self._cycles, None)
+        if cycle is None:
+            elapsed = time.monotonic() - self._started
+            logging.info(f"Replay concluído: {self.replayed} ciclos em {elapsed:.1f}s")
+            raise SystemExit(0)
+        if 'printers' in cycle:
+            self._printers = cycle['printers']
+        self._cycle = cycle
+
+    def recorded_time(self):
+        """Hora em que o ciclo corrente foi gravado (base da janela DAYS_TO_LOOK_BACK)"""
+        return self._cycle['t']
+
+    def getJobs(self, my_jobs=False, which_jobs='not-completed', first_job_id=1, limit=-1,
+                requested_attributes=None):
+        if which_jobs == 'completed':
+            ids = sorted(j for j in self._cycle['completed'] if j >= first_job_id)
+            if limit > 0:
+                ids = ids[:limit]
+            jobs = {j: self._cycle['completed'][j] for j in ids}
+        else:
+            jobs = self._cycle['active']
+        if requested_attributes is None:
+            return {j: dict(attrs) for j, attrs in jobs.items()}
+        return {j: {k: v for k, v in attrs.items() if k in requested_attributes} for j, attrs in jobs.items()}
+
+    def getJobAttributes(self, job_id, requested_attributes=None):
+        """Atributos do job no ciclo gravado; vazio se ele não aparece (expurgado do CUPS)"""
+        attrs = self._cycle['completed'].get(job_id) or self._cycle['active'].get(job_id) or {}
+        if requested_attributes is None:
+            return dict(attrs)
+        return {k: v for k, v in attrs.items() if k in requested_attributes}
+
+    def end_cycle(self, interval):
+        """Espera o intervalo gravado até o próximo ciclo (dividido por speed)"""
+        previous = self._cycle['t']
+        self.replayed += 1
+        self._advance()
+        if self.speed:
+            time.sleep(max(0.0, self._cycle['t'] - previous) / self.speed)
+
+def end_cycle(cups_conn, interval):
+    """Fim de um ciclo do monitor: grava/avança o replay ou apenas espera o intervalo"""
+    finish = getattr(cups_conn, 'end_cycle', None)
+    if finish is not None:
+        finish(interval)
+    else:
+        time.sleep(interval)
+
+def source_time(cups_conn):
+    """Hora de referência da fonte: a da gravação no replay, a atual no CUPS real"""
+    clock = getattr(cups_conn, 'recorded_time', None)
+    return clock() if clock is not None else time.time()
@@ -0,0 +1,266 @@
+# Eleição de líder entre instâncias do cups_monitor (ativo/passivo).
+#
+# O líder segura GET_LOCK em uma conexão própria, e uma thread grava heartbeat (e o
+# último checkpoint) em monitor_leader a cada HEARTBEAT_INTERVAL, independente da
+# duração do ciclo. O lock cai junto com a conexão, então um processo que morre libera
+# o posto na hora; se o host do líder some (conexão pendurada), o heartbeat para e o
+# standby derruba a sessão com KILL após LEASE_TIMEOUT. Se só o loop principal trava,
+# a thread deixa de renovar depois de STALL_TIMEOUT sem progresso e o lease vence.
+import json
+import logging
+import socket
+import threading
+import time
+from dotenv import load_dotenv
+import os
+
+# Carregar variáveis do .env
+load_dotenv("/opt/cups_monitor_env/.env")
+
+MYSQL_HOST = os.getenv("MYSQL_HOST")
+MYSQL_USER = os.getenv("MYSQL_USER")
+MYSQL_PASS = os.getenv("MYSQL_PASS")
+MYSQL_DB   = os.getenv("MYSQL_DB")
+
+LOCK_NAME = "cups_monitor_leader"
+HEARTBEAT_INTERVAL = 2   # segundos entre heartbeats da thread do líder
+LEASE_TIMEOUT = 10       # segundos sem heartbeat até o standby assumir à força
+STALL_TIMEOUT = 120      # segundos sem progresso do loop até a thread parar de renovar
+STANDBY_POLL = 1         # segundos entre tentativas do standby
+MAX_FAILOVER_MS = 2**31 - 1  # limite da coluna INT last_failover_ms
+
+HOLDER = f"{socket.gethostname()}:{os.getpid()}"
+
+_conn = None
+_conn_lock = threading.Lock()   # a conexão do lock é usada pela thread e pelo loop
+_lost = threading.Event()
+_stop = threading.Event()
+_thread = None
+# Quando o loop principal deu sinal de vida pela última vez (heartbeat())
+_state = {'progress': 0.0}
+
+def _connect():
+    import mysql.connector
+    return mysql.connector.connect(
+        host=MYSQL_HOST,
+        user=MYSQL_USER,
+        password=MYSQL_PASS,
+        database=MYSQL_DB,
+        autocommit=True
+    )
+
+def _drop_conn():
+    """Fecha a conexão do lock (e com ela o GET_LOCK) antes de descartá-la"""
+    global _conn
+    if _conn is not None:
+        try:
+            _conn.close()
+        except Exception:
+            pass
+    _conn = None
+
+def _scalar(cursor, query, params=()):
+    cursor.execute(query, params)
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def take_over_stale_leader(cursor):
+    """Encerra a sessão de um líder sem heartbeat há mais de LEASE_TIMEOUT"""
+    cursor.execute("""
+        SELECT holder, TIMESTAMPDIFF(MICROSECOND, heartbeat_at, NOW(3)) / 1000000
+        FROM monitor_leader WHERE name = %s
+    """, (LOCK_NAME,))
+    row = cursor.fetchone()
+    if row is None or row[1] is None or row[1] < LEASE_TIMEOUT:
+        return
+    connection_id = _scalar(cursor, "SELECT IS_USED_LOCK(%s)", (LOCK_NAME,))
+    if connection_id:
+        logging.warning(f"Líder {row[0]} sem heartbeat há {row[1]:.0f}s; encerrando a sessão {connection_id}")
+        try:
+            cursor.execute(f"KILL {int(connection_id)}")
+        except Exception as e:
+            logging.error(f"Não foi possível encerrar a sessão do líder: {e}")
+
+def wait_for_leadership():
+    """Bloqueia como standby até obter o lock; retorna o checkpoint deixado pelo líder anterior"""
+    global _conn
+    announced = False
+    waiting_since = None
+    while True:
+        try:
+            if _conn is None or not _conn.is_connected():
+                _conn = _connect()
+            cursor = _conn.cursor()
+            try:
+                if _scalar(cursor, "SELECT GET_LOCK(%s, 0)", (LOCK_NAME,)) == 1:
+                    waited = None if waiting_since is None else time.monotonic() - waiting_since
+                    checkpoint = _become_leader(cursor, waited)
+                    _start_heartbeat()
+                    return checkpoint
+                if waiting_since is None:
+                    waiting_since = time.monotonic()
+                take_over_stale_leader(cursor)
+            finally:
+                cursor.close()
+        except Exception as e:
+            logging.error(f"Erro na eleição de líder: {e}")
+            _drop_conn()
+        if not announced:
+            logging.info(f"Instância {HOLDER} em standby")
+            announced = True
+        time.sleep(STANDBY_POLL)
+
+def _become_leader(cursor, waited=None):
+    """Registra esta instância como líder; waited é quanto ela esperou como standby.
+
+    O failover é medido do último heartbeat do líder anterior até a posse, limitado ao
+    tempo de espera do standby: um heartbeat antigo (serviço parado por dias) não vira
+    failover. Sem espera (nenhum líder vivo ao iniciar) não há failover a registrar.
+    """
+    cursor.execute("""
+        SELECT holder, checkpoint, TIMESTAMPDIFF(MICROSECOND, heartbeat_at, NOW(3)) DIV 1000
+        FROM monitor_leader WHERE name = %s
+    """, (LOCK_NAME,))
+    row = cursor.fetchone()
+    previous, checkpoint, heartbeat_age_ms = row if row else (None, None, None)
+    failover_ms = None
+    if waited is not None and heartbeat_age_ms is not None:
+        failover_ms = min(int(heartbeat_age_ms), int(waited * 1000), MAX_FAILOVER_MS)
+
+    cursor.execute("""
+        INSERT INTO monitor_leader (name, holder, acquired_at, heartbeat_at, last_failover_ms)
+        VALUES (%s, %s, NOW(3), NOW(3), %s)
+        ON DUPLICATE KEY UPDATE holder = VALUES(holder), acquired_at = VALUES(acquired_at),
+                                heartbeat_at = VALUES(heartbeat_at),
+                                last_failover_ms = COALESCE(VALUES(last_failover_ms), last_failover_ms)
+    """, (LOCK_NAME, HOLDER, failover_ms))
+
+    if previous and previous != HOLDER and failover_ms is not None:
+        logging.warning(f"Instância {HOLDER} assumiu a liderança de {previous}; "
+                        f"failover em {failover_ms} ms desde o último heartbeat")
+    else:
+        logging.info(f"Instância {HOLDER} é a líder")
+    try:
+        return json.loads(checkpoint) if checkpoint else None
+    except ValueError:
+        return None
+
+def _beat(checkpoint=None):
+    """Grava o heartbeat (e o checkpoint, se informado); False se o lock não é mais desta conexão"""
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            return False
+        try:
+            cursor = _conn.cursor()
+            try:
+                if _scalar(cursor, "SELECT IS_USED_LOCK(%s) = CONNECTION_ID()", (LOCK_NAME,)) != 1:
+                    return False
+                if checkpoint is None:
+                    cursor.execute("""
+                        UPDATE monitor_leader SET heartbeat_at = NOW(3)
+                        WHERE name = %s AND holder = %s
+                    """, (LOCK_NAME, HOLDER))
+                else:
+                    cursor.execute("""
+                        UPDATE monitor_leader SET heartbeat_at = NOW(3), checkpoint = %s
+                        WHERE name = %s AND holder = %s
+                    """, (json.dumps(checkpoint, default=str), LOCK_NAME, HOLDER))
+                return True
+            finally:
+                cursor.close()
+        except Exception as e:
+            logging.error(f"Erro no heartbeat do líder: {e}")
+            _drop_conn()
+            return False
+
+def _heartbeat_loop():
+    stalled = False
+    while not _stop.wait(HEARTBEAT_INTERVAL):
+        # Loop principal parado: deixa de renovar para o lease vencer e o standby assumir
+        if time.monotonic() - _state['progress'] > STALL_TIMEOUT:
+            if not stalled:
+                logging.error(f"Loop do monitor sem progresso há mais de {STALL_TIMEOUT}s; "
+                              f"heartbeat suspenso")
+                stalled = True
+            continue
+        stalled = False
+        if not _beat():
+            _lost.set()
+            return
+
+def _start_heartbeat():
+    global _thread
+    _lost.clear()
+    _stop.clear()
+    _state['progress'] = time.monotonic()
+    _thread = threading.Thread(target=_heartbeat_loop, name="leader-heartbeat", daemon=True)
+    _thread.start()
+
+def heartbeat(checkpoint):
+    """Sinal de vida do loop: entrega o checkpoint e confirma o lock; False se foi perdido"""
+    _state['progress'] = time.monotonic()
+    if _lost.is_set() or not _beat(checkpoint):
+        _lost.set()
+        return False
+    return True
+
+def still_leader():
+    """Confirma na hora, na conexão do lock, que esta instância ainda é a líder"""
+    if _lost.is_set() or not _beat():
+        _lost.set()
+        return False
+    return True
+
+def release():
+    """Libera o posto de líder (o standby assume no próximo STANDBY_POLL)"""
+    global _conn, _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(HEARTBEAT_INTERVAL + 5)
+        _thread = None
+    with _conn_lock:
+        if _conn is None:
+            return
+        try:
+            cursor = _conn.cursor()
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+            cursor.fetchall()
+            cursor.close()
+        except Exception:
+            pass
+        _drop_conn()
+
+def show_status():
+    """Líder atual, idade do heartbeat e duração do último failover"""
+    conn = _connect()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT holder, acquired_at, TIMESTAMPDIFF(MICROSECOND, heartbeat_at, NOW(3)) DIV 1000,
+                   last_failover_ms, IS_USED_LOCK(name) IS NOT NULL
+            FROM monitor_leader WHERE name = %s
+        """, (LOCK_NAME,))
+        row = cursor.fetchone()
+        if row is None:
+            print("Nenhuma instância assumiu a liderança ainda")
+            return
+        holder, acquired_at, heartbeat_ms, failover_ms, locked = row
+        print(f"Líder:            {holder}{'' if locked else ' (lock livre)'}")
+        print(f"Desde:            {acquired_at:%d/%m/%Y %H:%M:%S}")
+        print(f"Último heartbeat: há {heartbeat_ms} ms")
+        print(f"Último failover:  {'-' if failover_ms is None else f'{failover_ms} ms'}")
+    finally:
+        cursor.close()
+        conn.close()
+
+def main():
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] != "status":
+        print("Uso:")
+        print("  python3 leader.py status   - Líder atual e tempo do último failover")
+        return
+    show_status()
+
+if __name__ == "__main__":
+    main()
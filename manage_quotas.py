@@ -1,7 +1,7 @@
 #!/opt/cups_monitor_env/bin/python3
-import mysql.connector
 import sys
-import subprocess
+import csv
+import fnmatch
 from dotenv import load_dotenv
 import os
 
@@ -13,70 +13,192 @@ MYSQL_USER = os.getenv("MYSQL_USER")
 MYSQL_PASS = os.getenv("MYSQL_PASS")
 MYSQL_DB   = os.getenv("MYSQL_DB")
 
-def manage_quotas():
-    """Script de gerenciamento de cotas"""
-    if len(sys.argv) < 2:
+CUPS_STOPPED = 5  # printer-state "parada"
+DB_COMMANDS = ("status", "set", "reset", "report")  # os demais só usam o CUPS
+
+# ========== ALVOS ==========
+def load_targets(spec, value=None):
+    """Lista de (padrão, valor) a partir de um CSV (IMPRESSORA[,VALOR]) ou de um padrão glob.
+
+    No CSV, linhas vazias, comentários (#) e o cabeçalho são ignorados; a coluna de
+    valor é opcional e, se ausente, vale o valor passado na linha de comando.
+    """
+    if not spec.lower().endswith(".csv"):
+        return [(spec, value)]
+
+    targets = []
+    with open(spec, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip() or row[0].lstrip().startswith("#"):
+                continue
+            name = row[0].strip()
+            if name.lower() in ("impressora", "printer", "name"):
+                continue
+            row_value = row[1].strip() if len(row) > 1 and row[1].strip() else value
+            targets.append((name, row_value))
+    return targets
+
+def match_targets(targets, names):
+    """Expande os padrões contra os nomes conhecidos; retorna {nome: valor} e padrões sem correspondência"""
+    matched = {}
+    unmatched = []
+    for pattern, value in targets:
+        found = fnmatch.filter(names, pattern)
+        if not found:
+            unmatched.append(pattern)
+        for name in found:
+            matched[name] = value
+    return matched, unmatched
+
+def report_unmatched(unmatched):
+    for pattern in unmatched:
+        print(f"Aviso: nenhuma impressora corresponde a '{pattern}'")
+
+# ========== ALTERAÇÕES EM LOTE ==========
+def load_printers(cursor):
+    cursor.execute("SELECT name, monthly_quota, current_count, alert_level FROM printers")
+    return {row['name']: row for row in cursor.fetchall()}
+
+def bulk_set(cursor, db, targets, dry_run=False):
+    """Define a cota das impressoras selecionadas em uma única transação"""
+    printers = load_printers(cursor)
+    matched, unmatched = match_targets(targets, list(printers))
+    report_unmatched(unmatched)
+
+    changes = []
+    for name in sorted(matched):
+        if matched[name] is None:
+            raise ValueError(f"Cota não informada para {name}")
+        quota = int(matched[name])
+        if quota != printers[name]['monthly_quota']:
+            print(f"{name}: cota {printers[name]['monthly_quota']} -> {quota}")
+            changes.append((quota, name))
+
+    if changes and not dry_run:
+        cursor.executemany("UPDATE printers SET monthly_quota = %s WHERE name = %s", changes)
+        db.commit()
+    return len(changes)
+
+def bulk_reset(cursor, db, targets, dry_run=False):
+    """Zera o contador (e a faixa de alerta) das impressoras selecionadas em uma única transação"""
+    printers = load_printers(cursor)
+    matched, unmatched = match_targets(targets, list(printers))
+    report_unmatched(unmatched)
+
+    changes = []
+    for name in sorted(matched):
+        if printers[name]['current_count'] or printers[name]['alert_level']:
+            print(f"{name}: contador {printers[name]['current_count']} -> 0")
+            changes.append((name,))
+
+    if changes and not dry_run:
+        cursor.executemany("UPDATE printers SET current_count = 0, alert_level = 0 WHERE name = %s", changes)
+        db.commit()
+    return len(changes)
+
+def bulk_cups_state(targets, enable, dry_run=False):
+    """Habilita/desabilita as filas selecionadas em uma passada com uma conexão pycups.
+
+    Filas que já estão no estado pedido não são tocadas.
+    """
+    import cups
+    conn = cups.Connection()
+    printers = conn.getPrinters()
+    matched, unmatched = match_targets(targets, list(printers))
+    report_unmatched(unmatched)
+
+    changed = 0
+    for name in sorted(matched):
+        stopped = printers[name].get('printer-state') == CUPS_STOPPED
+        if stopped != enable:
+            continue
+        print(f"{name}: {'parada -> ativa' if enable else 'ativa -> parada'}")
+        if dry_run:
+            changed += 1
+            continue
+        try:
+            if enable:
+                conn.enablePrinter(name)
+            else:
+                conn.disablePrinter(name)
+            changed += 1
+        except cups.IPPError as e:
+            print(f"Erro ao alterar {name}: {e}")
+    return changed
+
+def manage_quotas(db=None):
+    """Script de gerenciamento de cotas (db: conexão compartilhada, se houver)"""
+    dry_run = "--dry-run" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "--dry-run"]
+    if not args:
         print("Uso:")
         print("  python3 manage_quotas.py status                    - Status atual")
-        print("  python3 manage_quotas.py set IMPRESSORA COTA       - Define cota")
-        print("  python3 manage_quotas.py reset IMPRESSORA          - Reset contador")
-        print("  python3 manage_quotas.py enable IMPRESSORA         - Habilita impressora")
-        print("  python3 manage_quotas.py disable IMPRESSORA        - Bloqueia impressora")
+        print("  python3 manage_quotas.py set ALVO COTA             - Define cota")
+        print("  python3 manage_quotas.py set ARQUIVO.csv           - Define cotas (IMPRESSORA,COTA)")
+        print("  python3 manage_quotas.py reset ALVO                - Reset contador")
+        print("  python3 manage_quotas.py enable ALVO               - Habilita impressora")
+        print("  python3 manage_quotas.py disable ALVO              - Bloqueia impressora")
         print("  python3 manage_quotas.py report                    - Relatório detalhado")
+        print()
+        print("  ALVO: nome, padrão glob ('HP_*') ou ARQUIVO.csv com uma impressora por linha")
+        print("  --dry-run: mostra as alterações sem aplicá-las")
         return
     
-    command = sys.argv[1]
+    command = args[0]
+    own_db = db is None
+    cursor = None
     
     try:
-        db = mysql.connector.connect(
-            host=MYSQL_HOST,
-            user=MYSQL_USER,
-            password=MYSQL_PASS,
-            database=MYSQL_DB
-        )
-        cursor = db.cursor(dictionary=True)
+        if command in DB_COMMANDS:
+            if own_db:
+                import mysql.connector
+                db = mysql.connector.connect(
+                    host=MYSQL_HOST,
+                    user=MYSQL_USER,
+                    password=MYSQL_PASS,
+                    database=MYSQL_DB
+                )
+            cursor = db.cursor(dictionary=True)
         
         if command == "status":
-            # Importar e executar status
-            import os
-            os.system('/opt/cups_monitor_env/quota_status.py')
-            
-        elif command == "set" and len(sys.argv) == 4:
-            printer = sys.argv[2]
-            quota = int(sys.argv[3])
-            cursor.execute("UPDATE printers SET monthly_quota = %s WHERE name = %s", (quota, printer))
-            db.commit()
-            print(f"Cota da {printer} ajustada para {quota} páginas/mês")
+            from quota_status import show_quota_status
+            show_quota_status(db=db)
             
-        elif command == "reset" and len(sys.argv) == 3:
-            printer = sys.argv[2]
-            cursor.execute("UPDATE printers SET current_count = 0 WHERE name = %s", (printer,))
-            db.commit()
-            print(f"Contador da {printer} resetado")
+        elif command == "set" and len(args) in (2, 3):
+            quota = args[2] if len(args) == 3 else None
+            changed = bulk_set(cursor, db, load_targets(args[1], quota), dry_run)
+            print(f"{changed} cota(s) {'a ajustar' if dry_run else 'ajustada(s)'}")
             
-        elif command == "enable" and len(sys.argv) == 3:
-            printer = sys.argv[2]
-            subprocess.run(['cupsenable', printer], check=True)
-            print(f"Impressora {printer} habilitada")
+        elif command == "reset" and len(args) == 2:
+            changed = bulk_reset(cursor, db, load_targets(args[1]), dry_run)
+            print(f"{changed} contador(es) {'a resetar' if dry_run else 'resetado(s)'}")
             
-        elif command == "disable" and len(sys.argv) == 3:
-            printer = sys.argv[2]
-            subprocess.run(['cupsdisable', printer], check=True)
-            print(f"Impressora {printer} desabilitada")
+        elif command in ("enable", "disable") and len(args) == 2:
+            enable = command == "enable"
+            changed = bulk_cups_state(load_targets(args[1]), enable, dry_run)
+            action = "habilitada(s)" if enable else "desabilitada(s)"
+            print(f"{changed} impressora(s) {'a alterar' if dry_run else action}")
             
         elif command == "report":
-            import os
-            os.system('/opt/cups_monitor_env/weekly_report.py')
+            from weekly_report import generate_weekly_report
+            generate_weekly_report(db)
             
         else:
             print("Comando inválido")
             
     except Exception as e:
+        try:
+            if db is not None:
+                db.rollback()
+        except:
+            pass
         print(f"Erro: {e}")
     finally:
         try:
-            cursor.close()
-            db.close()
+            if cursor is not None:
+                cursor.close()
+            if own_db and db is not None:
+                db.close()
         except:
             pass
 
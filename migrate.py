@@ -0,0 +1,316 @@
+#!/opt/cups_monitor_env/bin/python3
+import mysql.connector
+import sys
+from dotenv import load_dotenv
+import os
+
+# Carregar variáveis do .env
+load_dotenv("/opt/cups_monitor_env/.env")
+
+MYSQL_HOST = os.getenv("MYSQL_HOST")
+MYSQL_USER = os.getenv("MYSQL_USER")
+MYSQL_PASS = os.getenv("MYSQL_PASS")
+MYSQL_DB   = os.getenv("MYSQL_DB")
+
+# ========== HELPERS ==========
+def column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    return cursor.fetchone() is not None
+
+def index_exists(cursor, table, index):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, index))
+    return cursor.fetchone() is not None
+
+def is_partitioned(cursor, table):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        LIMIT 1
+    """, (table,))
+    return cursor.fetchone() is not None
+
+def add_column(cursor, table, column, definition):
+    if not column_exists(cursor, table, column):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def add_index(cursor, table, index, definition):
+    if not index_exists(cursor, table, index):
+        cursor.execute(f"ALTER TABLE {table} ADD {definition}")
+
+# ========== MIGRAÇÕES ==========
+def m001_initial_schema(cursor):
+    """Tabelas principais (não altera tabelas já existentes)"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS printers (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            ip_address VARCHAR(64) NOT NULL DEFAULT 'unknown',
+            monthly_quota INT NOT NULL DEFAULT 1000,
+            current_count INT NOT NULL DEFAULT 0,
+            alert_level TINYINT NOT NULL DEFAULT 0,
+            created_at DATETIME NULL,
+            updated_at DATETIME NULL,
+            UNIQUE KEY uq_printers_name (name)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS print_jobs (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            printer VARCHAR(255) NOT NULL,
+            user VARCHAR(255) NOT NULL,
+            job_id VARCHAR(64) NOT NULL,
+            title VARCHAR(512) NULL,
+            pages INT NULL,
+            weighted_pages INT NULL,
+            completed_at DATETIME NULL,
+            created_at DATETIME NULL,
+            updated_at DATETIME NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS quota_alerts (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            printer_name VARCHAR(255) NOT NULL,
+            alert_type VARCHAR(32) NOT NULL,
+            current_usage INT NULL,
+            quota_limit INT NULL,
+            message VARCHAR(512) NULL,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS print_usage_daily (
+            day DATE NOT NULL,
+            printer VARCHAR(255) NOT NULL,
+            user VARCHAR(255) NOT NULL,
+            jobs INT NOT NULL DEFAULT 0,
+            pages INT NOT NULL DEFAULT 0,
+            weighted_pages INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, printer, user),
+            KEY idx_usage_daily_user (day, user)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+def m002_cost_and_alert_columns(cursor):
+    """Colunas de custo ponderado e nível de alerta em bancos anteriores"""
+    add_column(cursor, "print_jobs", "weighted_pages", "INT NULL AFTER pages")
+    add_column(cursor, "printers", "alert_level", "TINYINT NOT NULL DEFAULT 0")
+
+def m003_hot_path_indexes(cursor):
+    """Chaves únicas e índices de cobertura das consultas críticas"""
+    cursor.execute("""
+        SELECT job_id, COUNT(*) AS copies FROM print_jobs
+        GROUP BY job_id HAVING COUNT(*) > 1 LIMIT 5
+    """)
+    duplicated = cursor.fetchall()
+    if duplicated:
+        ids = ", ".join(str(row['job_id']) for row in duplicated)
+        raise RuntimeError(f"job_id duplicado em print_jobs ({ids}); remova as duplicatas antes de migrar")
+
+    add_index(cursor, "printers", "uq_printers_name", "UNIQUE KEY uq_printers_name (name)")
+    # Em tabela particionada a chave única precisa conter a coluna de partição
+    if is_partitioned(cursor, "print_jobs"):
+        add_index(cursor, "print_jobs", "uq_print_jobs_job_id",
+                  "UNIQUE KEY uq_print_jobs_job_id (job_id, completed_at)")
+    else:
+        add_index(cursor, "print_jobs", "uq_print_jobs_job_id",
+                  "UNIQUE KEY uq_print_jobs_job_id (job_id)")
+    add_index(cursor, "print_jobs", "idx_print_jobs_completed_user",
+              "KEY idx_print_jobs_completed_user (completed_at, user, pages)")
+    add_index(cursor, "quota_alerts", "idx_quota_alerts_lookup",
+              "KEY idx_quota_alerts_lookup (printer_name, alert_type, created_at)")
+
+def m004_printer_removed_at(cursor):
+    """Marca de remoção das filas que saíram do CUPS (sincronização de impressoras)"""
+    add_column(cursor, "printers", "removed_at", "DATETIME NULL")
+
+def m005_quota_reset_runs(cursor):
+    """Resumo de cada execução do reset mensal"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS quota_reset_runs (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            started_at DATETIME NOT NULL,
+            finished_at DATETIME NOT NULL,
+            printers INT NOT NULL,
+            pages_before BIGINT NOT NULL,
+            exhausted INT NOT NULL,
+            reenabled INT NOT NULL,
+            reenable_failures INT NOT NULL,
+            duration_ms INT NOT NULL,
+            KEY idx_quota_reset_runs_started (started_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+def m006_report_recipients(cursor):
+    """Departamento das impressoras e destinatários dos resumos semanais"""
+    add_column(cursor, "printers", "department", "VARCHAR(100) NULL")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS report_recipients (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            email VARCHAR(255) NOT NULL,
+            department VARCHAR(100) NULL,
+            printer_name VARCHAR(255) NULL,
+            KEY idx_report_recipients_email (email)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+def m007_monitor_leader(cursor):
+    """Heartbeat e checkpoint do líder no modo ativo/passivo"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS monitor_leader (
+            name VARCHAR(64) PRIMARY KEY,
+            holder VARCHAR(255) NOT NULL,
+            acquired_at DATETIME(3) NOT NULL,
+            heartbeat_at DATETIME(3) NOT NULL,
+            last_failover_ms INT NULL,
+            checkpoint MEDIUMTEXT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+def m008_print_job_ids(cursor):
+    """Registro único de job_id, independente do particionamento de print_jobs.
+
+    Particionada, print_jobs só aceita chave única com completed_at, e o importador do
+    page_log e o monitor gravam horários de conclusão diferentes para o mesmo job.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS print_job_ids (
+            job_id VARCHAR(64) NOT NULL PRIMARY KEY,
+            claim CHAR(32) NULL,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    cursor.execute("INSERT IGNORE INTO print_job_ids (job_id) SELECT DISTINCT job_id FROM print_jobs")
+
+MIGRATIONS = [
+    (1, "esquema inicial", m001_initial_schema),
+    (2, "colunas de custo ponderado e nível de alerta", m002_cost_and_alert_columns),
+    (3, "índices dos caminhos críticos", m003_hot_path_indexes),
+    (4, "marca de impressoras removidas do CUPS", m004_printer_removed_at),
+    (5, "resumo das execuções do reset mensal", m005_quota_reset_runs),
+    (6, "departamentos e destinatários dos resumos semanais", m006_report_recipients),
+    (7, "liderança do monitor ativo/passivo", m007_monitor_leader),
+    (8, "registro único de job_id (print_job_ids)", m008_print_job_ids),
+]
+
+# Consultas críticas verificadas pelo comando check (não podem varrer a tabela inteira)
+HOT_QUERIES = [
+    ("busca de job por job_id",
+     "SELECT id, completed_at FROM print_jobs WHERE job_id = %s", ("1",)),
+    ("cota da impressora",
+     "SELECT id, monthly_quota, current_count FROM printers WHERE name = %s", ("x",)),
+    ("alerta do dia por impressora",
+     """SELECT id FROM quota_alerts
+        WHERE printer_name = %s AND alert_type = 'WARNING' AND created_at >= CURDATE()""", ("x",)),
+    ("backfill do rollup por período",
+     """SELECT user, COUNT(*), SUM(pages) FROM print_jobs
+        WHERE completed_at >= CURDATE() - INTERVAL 1 DAY AND completed_at < CURDATE()
+        GROUP BY user""", ()),
+    ("top usuários do rollup",
+     """SELECT user, SUM(pages) FROM print_usage_daily
+        WHERE day BETWEEN CURDATE() - INTERVAL 6 DAY AND CURDATE() GROUP BY user""", ()),
+]
+
+# ========== EXECUÇÃO ==========
+def ensure_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+def applied_versions(cursor):
+    ensure_migrations_table(cursor)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row['version'] for row in cursor.fetchall()}
+
+def upgrade(cursor, db):
+    """Aplica, em ordem, as migrações pendentes"""
+    done = applied_versions(cursor)
+    applied = 0
+    for version, description, migration in MIGRATIONS:
+        if version in done:
+            continue
+        print(f"Aplicando {version:03d} - {description}")
+        migration(cursor)
+        cursor.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                       (version, description))
+        db.commit()
+        applied += 1
+    return applied
+
+def check_hot_queries(cursor):
+    """Roda EXPLAIN nas consultas críticas; retorna as que fariam full scan"""
+    failures = []
+    for name, query, params in HOT_QUERIES:
+        cursor.execute("EXPLAIN " + query, params)
+        for row in cursor.fetchall():
+            if row.get('type') == 'ALL':
+                failures.append((name, row.get('table'), row.get('possible_keys')))
+    return failures
+
+def main():
+    if len(sys.argv) < 2:
+        print("Uso:")
+        print("  python3 migrate.py status    - Migrações aplicadas e pendentes")
+        print("  python3 migrate.py upgrade   - Aplica migrações pendentes")
+        print("  python3 migrate.py check     - EXPLAIN das consultas críticas (falha em full scan)")
+        return 0
+
+    command = sys.argv[1]
+    exit_code = 0
+
+    try:
+        db = mysql.connector.connect(
+            host=MYSQL_HOST,
+            user=MYSQL_USER,
+            password=MYSQL_PASS,
+            database=MYSQL_DB
+        )
+        cursor = db.cursor(dictionary=True)
+
+        if command == "status":
+            done = applied_versions(cursor)
+            for version, description, _ in MIGRATIONS:
+                state = "aplicada" if version in done else "PENDENTE"
+                print(f"{version:03d} {state:<9} {description}")
+
+        elif command == "upgrade":
+            applied = upgrade(cursor, db)
+            print(f"{applied} migração(ões) aplicada(s)")
+
+        elif command == "check":
+            failures = check_hot_queries(cursor)
+            for name, table, possible_keys in failures:
+                print(f"FULL SCAN: {name} (tabela {table}, índices possíveis: {possible_keys})")
+            if failures:
+                exit_code = 1
+            else:
+                print(f"OK: {len(HOT_QUERIES)} consultas críticas usam índice")
+
+        else:
+            print("Comando inválido")
+            exit_code = 2
+
+    except Exception as e:
+        print(f"Erro: {e}")
+        exit_code = 1
+    finally:
+        try:
+            cursor.close()
+            db.close()
+        except:
+            pass
+
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
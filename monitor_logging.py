@@ -0,0 +1,83 @@
+# Log assíncrono do monitor: o loop principal só enfileira os registros
+# (QueueHandler) e uma thread do QueueListener faz a escrita no arquivo.
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+from datetime import datetime
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+_listener = None
+
+class JsonLinesFormatter(logging.Formatter):
+    """Um objeto JSON por linha; campos passados em extra={'fields': {...}} vão junto"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class MonitorQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que mantém o traceback fora da mensagem.
+
+    O prepare() padrão junta o traceback ao msg e limpa exc_info, e o formatter JSON
+    do listener não teria como separar o campo 'exception'. Aqui a mensagem é
+    resolvida no produtor e o traceback vai formatado em exc_text.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None  # o traceback segura os frames do produtor
+        return record
+
+def setup_logging(log_file, level=logging.INFO, json_lines=False):
+    """Troca os handlers do logger raiz por uma fila atendida em segundo plano.
+
+    O arquivo é aberto com WatchedFileHandler, que reabre o log após o logrotate.
+    """
+    global _listener
+    stop_logging()
+
+    handler = logging.handlers.WatchedFileHandler(log_file, encoding="utf-8")
+    handler.setFormatter(JsonLinesFormatter() if json_lines else logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+        old.close()
+    root.addHandler(MonitorQueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+def stop_logging():
+    """Esvazia a fila e encerra a thread de escrita"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+atexit.register(stop_logging)
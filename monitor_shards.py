@@ -0,0 +1,258 @@
+# Modo com vários processos do cups_monitor (--workers N).
+#
+# O supervisor é o único leitor do CUPS: lê os jobs, monta os registros e entrega a
+# cada worker os jobs das impressoras da sua partição. Cada worker tem a própria
+# conexão MySQL, grava seu lote, aplica as cotas das suas impressoras e confirma o
+# ciclo. Impressoras diferentes nunca disputam as mesmas linhas (printers, rollup).
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import cups_monitor as monitor
+from job_source import DryRunConnection
+
+PARTITIONS = 64          # Partições virtuais distribuídas entre os workers
+CYCLE_TIMEOUT = 60       # segundos de espera pela confirmação dos workers em um ciclo
+RESTART_LIMIT = 5        # reinícios em RESTART_WINDOW antes de redistribuir as partições
+RESTART_WINDOW = 600
+
+def partition_of(printer):
+    """Partição estável entre processos (hash() do Python varia por processo)"""
+    return zlib.crc32(printer.encode("utf-8")) % PARTITIONS
+
+def assign_partitions(live):
+    """Distribui as partições entre os workers vivos: {worker: conjunto de partições}"""
+    assignment = {index: set() for index in live}
+    for partition in range(PARTITIONS):
+        assignment[live[partition % len(live)]].add(partition)
+    return assignment
+
+# ========== WORKER ==========
+def worker_main(index, inbox, results, dry_run=False):
+    """Processo worker: grava os jobs recebidos e aplica as cotas da sua partição.
+
+    dry_run (replay) usa os estados de fila enviados pelo supervisor e não toca no CUPS.
+    """
+    monitor.setup_logging(monitor.LOG_FILE, monitor.LOG_LEVEL, monitor.LOG_JSON)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    db = monitor.get_db_connection()
+    cursor = db.cursor(dictionary=True)
+    cups_conn = DryRunConnection() if dry_run else monitor.cups.Connection()
+    monitor.load_alert_levels(cursor)
+    owned = None
+    logging.info(f"Worker {index} iniciado")
+
+    try:
+        while True:
+            message = inbox.get()
+            if message is None:
+                break
+            cycle_id, records, partitions, printers = message
+            if printers is not None:
+                cups_conn.set_printers(printers)
+            try:
+                if partitions != owned:
+                    # Partições recebidas de outro worker: os níveis de alerta dele estão no banco
+                    owned = partitions
+                    monitor.load_alert_levels(cursor)
+                for record in records:
+                    monitor.store_job(cursor, record)
+                monitor.flush_batch(cursor, db)
+                if monitor.QUOTA_CHECK_ENABLED:
+                    monitor.enforce_quotas(cursor, db, cups_conn, lambda name: partition_of(name) in owned)
+                results.put((index, cycle_id, True, [r['job_id'] for r in records],
+                             dict(monitor.cycle_stats)))
+            except Exception as e:
+                logging.exception("Erro no worker %s: %s", index, e)
+                monitor.discard_batch()
+                try:
+                    db.rollback()
+                except Exception:
+                    pass
+                results.put((index, cycle_id, False, [], {}))
+            monitor.cycle_stats.clear()
+    finally:
+        monitor.notifications.stop()
+        try:
+            cursor.close()
+            db.close()
+        except Exception:
+            pass
+
+# ========== SUPERVISOR ==========
+def start_worker(context, index, results, dry_run=False):
+    inbox = context.Queue()
+    process = context.Process(target=worker_main, args=(index, inbox, results, dry_run),
+                              name=f"cups-monitor-worker-{index}", daemon=True)
+    process.start()
+    return {'process': process, 'inbox': inbox, 'restarts': []}
+
+def check_workers(context, workers, live, results, dry_run=False):
+    """Reinicia workers mortos; quem reinicia demais sai da distribuição.
+
+    Retorna True se o conjunto de workers vivos mudou (partições redistribuídas).
+    """
+    changed = False
+    now = time.monotonic()
+    for index in list(live):
+        worker = workers[index]
+        if worker['process'].is_alive():
+            continue
+        restarts = [t for t in worker['restarts'] if now - t < RESTART_WINDOW]
+        if len(restarts) >= RESTART_LIMIT and len(live) > 1:
+            logging.error(f"Worker {index} reiniciou {len(restarts)} vezes; partições redistribuídas")
+            live.remove(index)
+            changed = True
+            continue
+        logging.warning(f"Worker {index} terminou (código {worker['process'].exitcode}); reiniciando")
+        workers[index] = start_worker(context, index, results, dry_run)
+        workers[index]['restarts'] = restarts + [now]
+    return changed
+
+def collect_acks(results, cycle_id, expected, timeout=CYCLE_TIMEOUT):
+    """Espera a confirmação do ciclo pelos workers; retorna {worker: (ok, job_ids, stats)}"""
+    acks = {}
+    deadline = time.monotonic() + timeout
+    while len(acks) < len(expected):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            index, acked_cycle, ok, job_ids, stats = results.get(timeout=min(remaining, 1.0))
+        except queue.Empty:
+            # Worker morto não vai responder; não faz sentido esperar o prazo inteiro
+            if any(not expected[i]['process'].is_alive() for i in expected if i not in acks):
+                break
+            continue
+        if acked_cycle == cycle_id and index in expected:
+            acks[index] = (ok, job_ids, stats)
+    return acks
+
+def run_sharded(worker_count, ha=False, cups_conn=None, checkpoint_path=monitor.MONITOR_CHECKPOINT,
+                page_log_tail=monitor.PAGE_LOG_TAIL, snapshot_path=monitor.STATUS_SNAPSHOT):
+    """Supervisor: lê o CUPS, distribui os jobs por partição e mantém os workers.
+
+    checkpoint_path, page_log_tail e snapshot_path como em cups_monitor.main_loop; com uma
+    conexão de replay os workers também não tocam no CUPS.
+    """
+    monitor.setup_logging(monitor.LOG_FILE, monitor.LOG_LEVEL, monitor.LOG_JSON)
+    signal.signal(signal.SIGTERM, monitor.handle_sigterm)
+    if ha:
+        # Entre dois heartbeats do supervisor cabe a espera pelas confirmações dos workers
+        monitor.start_as_leader(monitor.MAX_CYCLE_SECONDS + CYCLE_TIMEOUT + monitor.CHECK_INTERVAL,
+                                checkpoint_path)
+    else:
+        monitor.load_monitor_checkpoint(checkpoint_path)
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+
+    cups_conn = cups_conn or monitor.cups.Connection()
+    db = monitor.get_db_connection()
+    cursor = db.cursor(dictionary=True)
+    known_printers = monitor.sync_printers(cursor, cups_conn.getPrinters())
+    db.commit()
+    last_sync = time.monotonic()
+
+    dry_run = isinstance(cups_conn, DryRunConnection)
+    page_log_state = monitor.new_tail_state(monitor.PAGE_LOG_FILE) if page_log_tail else None
+    page_totals = {}
+    cutoff = datetime.fromtimestamp(monitor.source_time(cups_conn)) - timedelta(days=monitor.DAYS_TO_LOOK_BACK)
+
+    workers = {index: start_worker(context, index, results, dry_run) for index in range(worker_count)}
+    live = list(workers)
+    assignment = assign_partitions(live)
+    owner = {p: index for index, parts in assignment.items() for p in parts}
+    logging.info(f"Monitor iniciado com {worker_count} workers e {PARTITIONS} partições")
+    cycle_id = 0
+
+    try:
+        while True:
+            try:
+                cycle_started = time.monotonic()
+                if ha:
+                    monitor.renew_leadership()
+                if check_workers(context, workers, live, results, dry_run):
+                    assignment = assign_partitions(live)
+                    owner = {p: index for index, parts in assignment.items() for p in parts}
+
+                cycle = {'settled': [], 'active': set(), 'lowest_seen': None}
+                last_completed = None
+                batches = defaultdict(list)
+                sync_needed = time.monotonic() - last_sync >= monitor.PRINTER_SYNC_INTERVAL
+                unknown_printers = set()
+                for record in monitor.read_cycle_jobs(cups_conn, page_log_state, page_totals, cutoff, cycle):
+                    last_completed = max(last_completed or '', record['completed_dt'].isoformat())
+                    if record['printer'] not in known_printers:
+                        unknown_printers.add(record['printer'])
+                        sync_needed = True
+                    batches[owner[partition_of(record['printer'])]].append(record)
+
+                # Filas novas precisam existir em printers antes que os workers gravem o uso
+                if sync_needed:
+                    known_printers = monitor.sync_printers(cursor, cups_conn.getPrinters()) | unknown_printers
+                    db.commit()
+                    last_sync = time.monotonic()
+
+                # Os workers gravam e aplicam as cotas: só despacha quem ainda é líder
+                if ha:
+                    monitor.confirm_leadership()
+                cycle_id += 1
+                expected = {index: workers[index] for index in live}
+                printers = cups_conn.getPrinters() if dry_run else None
+                for index in live:
+                    workers[index]['inbox'].put((cycle_id, batches.get(index, []), assignment[index], printers))
+
+                acks = collect_acks(results, cycle_id, expected)
+                cycle_stats = defaultdict(int)
+                for index in live:
+                    ok, job_ids, stats = acks.get(index, (False, [], {}))
+                    if ok:
+                        cycle['settled'].extend(job_ids)
+                        for key, value in stats.items():
+                            cycle_stats[key] += value
+                    elif index not in acks:
+                        # Jobs sem confirmação não entram em settled: seguram o watermark e voltam no próximo ciclo
+                        logging.warning(f"Worker {index} não confirmou o ciclo {cycle_id}")
+
+                monitor.advance_checkpoint(cycle['settled'], cycle['active'], cycle['lowest_seen'], last_completed)
+                monitor.save_monitor_checkpoint(checkpoint_path)
+                # Encerra a transação de leitura para o snapshot enxergar o que os workers gravaram
+                db.commit()
+                monitor.publish_status_snapshot(cursor, cups_conn, snapshot_path)
+                monitor.cycle_stats.update(cycle_stats)
+                monitor.log_cycle_summary(cycle_started)
+
+                monitor.end_cycle(cups_conn, monitor.CHECK_INTERVAL)
+
+            except Exception as e:
+                logging.exception("Erro no supervisor: %s", e)
+                try:
+                    db.rollback()
+                except Exception:
+                    pass
+                time.sleep(monitor.CHECK_INTERVAL)
+
+    finally:
+        monitor.save_monitor_checkpoint(checkpoint_path)
+        if ha:
+            monitor.step_down()
+        monitor.notifications.stop()
+        for worker in workers.values():
+            try:
+                worker['inbox'].put(None)
+            except Exception:
+                pass
+        for worker in workers.values():
+            worker['process'].join(10)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+        try:
+            cursor.close()
+            db.close()
+        except Exception:
+            pass
@@ -0,0 +1,206 @@
+# Despacho assíncrono de notificações (e-mail e webhook).
+#
+# notify() só enfileira e retorna; um worker em segundo plano agrupa os eventos por
+# destinatário durante COALESCE_WINDOW segundos e entrega cada grupo em uma mensagem,
+# reaproveitando uma única conexão SMTP. Quem aplica bloqueios nunca espera a entrega.
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from dotenv import load_dotenv
+import os
+
+# Carregar variáveis do .env
+load_dotenv("/opt/cups_monitor_env/.env")
+
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "25"))
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASS = os.getenv("SMTP_PASS")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "0") == "1"
+MAIL_FROM = os.getenv("MAIL_FROM", "cups-monitor@localhost")
+
+# Destinatários padrão: e-mails e URLs de webhook separados por vírgula
+NOTIFY_EMAILS = [r.strip() for r in os.getenv("NOTIFY_EMAILS", "").split(",") if r.strip()]
+NOTIFY_WEBHOOKS = [r.strip() for r in os.getenv("NOTIFY_WEBHOOKS", "").split(",") if r.strip()]
+
+COALESCE_WINDOW = 30   # segundos de agrupamento por destinatário
+QUEUE_SIZE = 10000     # eventos pendentes; acima disso novos eventos são descartados
+WEBHOOK_TIMEOUT = 10
+WEBHOOK_RETRIES = 3    # tentativas por entrega, com espera exponencial (1s, 2s, ...)
+SMTP_TIMEOUT = 30
+
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+_worker = None
+_worker_lock = threading.Lock()
+_STOP = object()
+
+# ========== SMTP ==========
+_smtp = None
+
+def smtp_connect():
+    """Abre uma sessão SMTP autenticada conforme o .env"""
+    import smtplib
+    smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    if SMTP_STARTTLS:
+        smtp.starttls()
+    if SMTP_USER:
+        smtp.login(SMTP_USER, SMTP_PASS or "")
+    return smtp
+
+def build_message(recipient, subject, body):
+    from email.mime.text import MIMEText
+    msg = MIMEText(body, "plain", "utf-8")
+    msg["From"] = MAIL_FROM
+    msg["To"] = recipient
+    msg["Subject"] = subject
+    return msg
+
+def _smtp_session():
+    """Conexão SMTP do worker, reaberta apenas se o servidor a encerrou"""
+    global _smtp
+    if _smtp is not None:
+        try:
+            if _smtp.noop()[0] == 250:
+                return _smtp
+        except Exception:
+            pass
+        close_smtp()
+    _smtp = smtp_connect()
+    return _smtp
+
+def close_smtp():
+    global _smtp
+    if _smtp is not None:
+        try:
+            _smtp.quit()
+        except Exception:
+            pass
+        _smtp = None
+
+def send_email(recipient, subject, body):
+    msg = build_message(recipient, subject, body)
+    try:
+        _smtp_session().send_message(msg)
+    except Exception:
+        # Uma nova tentativa com conexão nova (servidor pode ter derrubado a sessão ociosa)
+        close_smtp()
+        _smtp_session().send_message(msg)
+
+# ========== WEBHOOK ==========
+def post_webhook(url, events, retries=WEBHOOK_RETRIES):
+    """POST JSON com os eventos agrupados; repete com espera exponencial em caso de falha"""
+    import urllib.request
+    payload = json.dumps({'events': events}, ensure_ascii=False, default=str).encode("utf-8")
+    for attempt in range(retries):
+        try:
+            request = urllib.request.Request(url, data=payload, method="POST",
+                                             headers={"Content-Type": "application/json"})
+            with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT) as response:
+                if response.status < 300:
+                    return True
+                raise RuntimeError(f"HTTP {response.status}")
+        except Exception as e:
+            if attempt == retries - 1:
+                logging.error(f"Webhook {url} falhou após {retries} tentativas: {e}")
+                return False
+            time.sleep(2 ** attempt)
+    return False
+
+# ========== ENTREGA ==========
+def render_digest(events):
+    """Assunto e corpo de uma mensagem com os eventos agrupados de um destinatário"""
+    if len(events) == 1:
+        subject = events[0]['subject']
+    else:
+        subject = f"[Cotas de impressão] {len(events)} notificações"
+    lines = []
+    for event in events:
+        created = datetime.fromtimestamp(event['created_at']).strftime('%d/%m %H:%M:%S')
+        lines.append(f"{created} - {event['subject']}")
+        lines.append(f"    {event['message']}")
+    return subject, "\n".join(lines) + "\n"
+
+def deliver(pending):
+    """Entrega os eventos agrupados: uma mensagem (ou um POST) por destinatário"""
+    for recipient, events in pending.items():
+        try:
+            if recipient.startswith(("http://", "https://")):
+                post_webhook(recipient, events)
+            else:
+                subject, body = render_digest(events)
+                send_email(recipient, subject, body)
+            logging.info(f"Notificação entregue a {recipient} ({len(events)} evento(s))")
+        except Exception as e:
+            logging.error(f"Erro ao notificar {recipient}: {e}")
+
+def _run(window):
+    pending = defaultdict(list)
+    deadline = None
+    stopping = False
+    while not stopping:
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            event = _queue.get(timeout=timeout)
+        except queue.Empty:
+            event = None
+
+        if event is _STOP:
+            stopping = True
+        elif event is not None:
+            for recipient in event['recipients']:
+                pending[recipient].append(event)
+            if deadline is None:
+                deadline = time.monotonic() + window
+
+        if pending and (stopping or time.monotonic() >= deadline):
+            deliver(pending)
+            pending = defaultdict(list)
+            deadline = None
+    close_smtp()
+
+# ========== API ==========
+def start(window=COALESCE_WINDOW):
+    """Inicia o worker (chamado automaticamente pelo primeiro notify)"""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, args=(window,), name="notifications", daemon=True)
+            _worker.start()
+
+def stop(timeout=10):
+    """Entrega o que estiver pendente e encerra o worker"""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            return
+        try:
+            _queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logging.error("Fila de notificações cheia ao encerrar")
+        _worker.join(timeout)
+        _worker = None
+
+# Rede de segurança: o atexit roda em ordem inversa ao registro, e o do log
+# (monitor_logging) é registrado depois deste, então quem usa o log em fila deve
+# chamar stop() antes de sair (o monitor faz isso no finally do loop).
+atexit.register(stop)
+
+def notify(subject, message, recipients=None):
+    """Enfileira uma notificação sem bloquear; retorna False se ela foi descartada"""
+    recipients = recipients if recipients is not None else NOTIFY_EMAILS + NOTIFY_WEBHOOKS
+    if not recipients:
+        return False
+    start()
+    event = {'subject': subject, 'message': message, 'recipients': list(recipients),
+             'created_at': time.time()}
+    try:
+        _queue.put_nowait(event)
+        return True
+    except queue.Full:
+        logging.error(f"Fila de notificações cheia; descartado: {subject}")
+        return False
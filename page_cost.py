@@ -0,0 +1,52 @@
+# Modelo de custo ponderado por página (usado pelo monitor e pelo importador do page_log)
+import math
+
+# Custo ponderado por página: cor, frente/verso e tamanho do papel
+COLOR_COST = {'monochrome': 1.0, 'color': 3.0}
+SIDES_COST = {'one-sided': 1.0, 'two-sided': 0.75}
+MEDIA_COST = {'a4': 1.0, 'a3': 2.0}
+LARGE_MEDIA = ('a3', 'tabloid', 'ledger', '11x17')
+
+# Tabela pré-calculada (cor, lados, papel) -> fator aplicado às páginas
+PAGE_COST_TABLE = {
+    (color, sides, media): COLOR_COST[color] * SIDES_COST[sides] * MEDIA_COST[media]
+    for color in COLOR_COST
+    for sides in SIDES_COST
+    for media in MEDIA_COST
+}
+
+# ========== CÁLCULO ==========
+def first_value(v):
+    if isinstance(v, (list, tuple)):
+        return v[0] if v else None
+    return v
+
+def job_cost_key(attrs):
+    """Normaliza print-color-mode, sides e media na chave da PAGE_COST_TABLE"""
+    color = str(first_value(attrs.get('print-color-mode')) or '').lower()
+    sides = str(first_value(attrs.get('sides')) or '').lower()
+    media = str(first_value(attrs.get('media')) or '').lower()
+    return (
+        'color' if color == 'color' else 'monochrome',
+        'two-sided' if sides.startswith('two-sided') else 'one-sided',
+        'a3' if any(m in media for m in LARGE_MEDIA) else 'a4',
+    )
+
+def sheets_to_impressions(attrs, sheets):
+    """Converte folhas em faces impressas: em frente e verso cada folha tem duas.
+
+    Aproximação: um job frente e verso com número ímpar de páginas deixa o verso da
+    última folha em branco e sai com uma face a mais. Use só quando o CUPS não informa
+    job-impressions-completed nem job-pages-completed.
+    """
+    return sheets * 2 if job_cost_key(attrs)[1] == 'two-sided' else sheets
+
+def extract_cost(attrs, pages):
+    """Custo ponderado do job (arredondado para cima) a partir da tabela de custos.
+
+    pages são faces impressas (impressões), como no page_log; o fator de frente e verso
+    já reduz o custo, então contagens em folhas precisam passar por sheets_to_impressions.
+    """
+    if not pages:
+        return 0
+    return int(math.ceil(pages * PAGE_COST_TABLE[job_cost_key(attrs)]))
@@ -0,0 +1,407 @@
+#!/opt/cups_monitor_env/bin/python3
+import mysql.connector
+import sys
+import glob
+import gzip
+import json
+import logging
+import time
+import uuid
+from collections import defaultdict
+from datetime import date, datetime
+from functools import lru_cache
+from dotenv import load_dotenv
+import os
+
+from page_cost import extract_cost
+from usage_rollup import apply_rollup
+
+# Carregar variáveis do .env
+load_dotenv("/opt/cups_monitor_env/.env")
+
+MYSQL_HOST = os.getenv("MYSQL_HOST")
+MYSQL_USER = os.getenv("MYSQL_USER")
+MYSQL_PASS = os.getenv("MYSQL_PASS")
+MYSQL_DB   = os.getenv("MYSQL_DB")
+
+PAGE_LOG_DIR = "/var/log/cups"
+PAGE_LOG_NAME = "page_log"
+CHECKPOINT_FILE = "/var/lib/cups_monitor/page_log_import.json"
+FLUSH_LINES = 50000       # Linhas entre gravações no banco e no checkpoint
+OPEN_JOB_WINDOW = 2000    # Jobs com linhas nas últimas N linhas podem ainda estar imprimindo
+OPEN_JOB_IDLE = 600       # ... ou nos últimos N segundos do log
+ID_CHUNK = 1000           # job_ids por SELECT ... IN na reserva em print_job_ids
+TAIL_MAX_BYTES = 4 * 1024 * 1024   # Leitura máxima por ciclo no modo tail
+TAIL_BACKLOG_BYTES = 256 * 1024    # Ao iniciar, relê o fim do arquivo (jobs em andamento)
+TAIL_MAX_JOBS = 10000              # Totais mantidos em memória aguardando o job concluir
+
+# ========== PARSER ==========
+@lru_cache(maxsize=8192)
+def parse_timestamp(stamp):
+    """'20/May/2025:19:21:05 -0300' -> datetime local sem fuso (como o monitor grava)"""
+    return datetime.strptime(stamp, "%d/%b/%Y:%H:%M:%S %z").astimezone().replace(tzinfo=None)
+
+def parse_line(line):
+    """Quebra uma linha do PageLogFormat padrão do CUPS:
+
+    %p %u %j %T %P %C %{job-billing} %{job-originating-host-name} %{job-name} %{media} %{sides}
+
+    O título pode conter espaços, então media e sides são lidos do fim da linha.
+    Retorna (impressora, usuário, job_id, data, página, cópias, título, media, sides) ou None.
+    """
+    try:
+        printer, user, job_id, rest = line.split(' ', 3)
+        end = rest.index('] ')
+        fields = rest[end + 2:].split()
+        page = fields[0]
+        copies = int(fields[1])
+    except (ValueError, IndexError):
+        return None
+    if len(fields) >= 7:
+        title, media, sides = ' '.join(fields[4:-2]), fields[-2], fields[-1]
+    else:
+        title, media, sides = '', '', ''
+    return printer, user, job_id, rest[1:end], page, copies, title, media, sides
+
+def add_page_line(jobs, parsed, offset, line_no):
+    """Soma uma linha do page_log no total do job.
+
+    Linhas por página somam as cópias; uma linha 'total' (driver sem contagem por
+    página) traz o total de páginas do job e prevalece.
+    """
+    printer, user, job_id, stamp, page, copies, title, media, sides = parsed
+    job = jobs.get(job_id)
+    if job is None:
+        job = jobs[job_id] = {
+            'printer': printer, 'user': user, 'title': '' if title == '-' else title,
+            'pages': 0, 'total': False, 'media': media, 'sides': sides,
+            'first_offset': offset,
+        }
+    if page == 'total':
+        job['pages'] = copies
+        job['total'] = True
+    elif not job['total']:
+        job['pages'] += copies
+    job['stamp'] = stamp
+    job['last_line'] = line_no
+
+# ========== CARGA NO BANCO ==========
+def claim_job_ids(cursor, ids):
+    """Reserva em print_job_ids os job_ids ainda não gravados; retorna os reservados.
+
+    A chave única de print_jobs particionada inclui completed_at, então não impede o
+    mesmo job_id com outro horário. A reserva é feita na mesma transação da gravação:
+    um monitor gravando o mesmo job ao mesmo tempo espera o lock da chave e é ignorado.
+    """
+    claim = uuid.uuid4().hex
+    claimed = set()
+    for i in range(0, len(ids), ID_CHUNK):
+        chunk = ids[i:i + ID_CHUNK]
+        cursor.executemany("INSERT IGNORE INTO print_job_ids (job_id, claim) VALUES (%s, %s)",
+                           [(jid, claim) for jid in chunk])
+        cursor.execute(f"SELECT job_id FROM print_job_ids WHERE claim = %s "
+                       f"AND job_id IN ({', '.join(['%s'] * len(chunk))})", [claim] + chunk)
+        claimed.update(str(row[0]) for row in cursor.fetchall())
+    return claimed
+
+def load_jobs(cursor, db, jobs):
+    """Grava em lote os jobs agregados que ainda não estão em print_jobs (idempotente).
+
+    Também soma o rollup diário e, para jobs do mês corrente, o contador da impressora.
+    O page_log não registra o modo de cor: o custo considera só papel e frente/verso,
+    ou seja, jobs coloridos importados daqui são cobrados como monocromáticos.
+    Retorna o número de jobs novos.
+    """
+    claimed = claim_job_ids(cursor, [jid for jid, job in jobs.items() if job['pages'] > 0])
+
+    month_start = date.today().replace(day=1)
+    rows = []
+    usage = defaultdict(int)
+    rollup = defaultdict(lambda: [0, 0, 0])
+    for jid, job in jobs.items():
+        if jid not in claimed:
+            continue
+        completed = parse_timestamp(job['stamp'])
+        cost = extract_cost({'media': job['media'], 'sides': job['sides']}, job['pages'])
+        rows.append((job['printer'], job['user'], jid, job['title'], job['pages'], cost, completed))
+        totals = rollup[(completed.date(), job['printer'], job['user'])]
+        totals[0] += 1
+        totals[1] += job['pages']
+        totals[2] += cost
+        if completed.date() >= month_start:
+            usage[job['printer']] += cost
+
+    if rows:
+        cursor.executemany("""
+            INSERT INTO print_jobs (printer, user, job_id, title, pages, weighted_pages,
+                                    completed_at, created_at, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+        """, rows)
+    if usage:
+        cursor.executemany("""
+            UPDATE printers SET current_count = current_count + %s, updated_at = NOW()
+            WHERE name = %s
+        """, [(cost, printer) for printer, cost in usage.items()])
+    if rollup:
+        apply_rollup(cursor, rollup)
+    db.commit()
+    return len(rows)
+
+def flush_jobs(cursor, db, jobs, line_no, stamp=None, keep_open=True):
+    """Grava os jobs encerrados e retorna o número de jobs novos.
+
+    Um job segue aberto enquanto teve linhas nas últimas OPEN_JOB_WINDOW linhas ou nos
+    últimos OPEN_JOB_IDLE segundos (stamp é o horário da linha corrente): gravado cedo
+    demais, o resto das páginas seria descartado como job já reservado.
+    """
+    now = parse_timestamp(stamp) if stamp else None
+    closed = {
+        jid: job for jid, job in jobs.items()
+        if not keep_open or (line_no - job['last_line'] > OPEN_JOB_WINDOW and
+                             (now is None or (now - parse_timestamp(job['stamp'])).total_seconds()
+                              > OPEN_JOB_IDLE))
+    }
+    for jid in closed:
+        del jobs[jid]
+    return load_jobs(cursor, db, closed) if closed else 0
+
+# ========== ARQUIVOS E CHECKPOINT ==========
+def page_log_files(log_dir=PAGE_LOG_DIR):
+    """page_log e suas rotações (page_log.1, page_log.2.gz, page_log-AAAAMMDD.gz), do mais antigo ao atual"""
+    paths = glob.glob(os.path.join(log_dir, PAGE_LOG_NAME + '*'))
+    return sorted(paths, key=lambda path: os.stat(path).st_mtime)
+
+def file_key(path, st):
+    """Identidade do arquivo que sobrevive à rotação (renomear mantém o inode; o gzip não)"""
+    if path.endswith('.gz'):
+        return f"gz:{st.st_size}:{int(st.st_mtime)}"
+    return f"ino:{st.st_dev}:{st.st_ino}"
+
+def load_checkpoint(path=CHECKPOINT_FILE):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_checkpoint(checkpoint, path=CHECKPOINT_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+# ========== TAIL AO VIVO ==========
+def new_tail_state(path=os.path.join(PAGE_LOG_DIR, PAGE_LOG_NAME)):
+    """Estado do tail: começa perto do fim do arquivo atual"""
+    state = {'path': path, 'inode': None, 'offset': 0, 'partial': b'', 'line_no': 0}
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return state
+    state['inode'] = st.st_ino
+    state['offset'] = max(0, st.st_size - TAIL_BACKLOG_BYTES)
+    state['skip_partial'] = state['offset'] > 0  # a primeira linha lida pode estar cortada
+    # Jobs vistos na releitura inicial podem ter páginas antes do trecho relido
+    state['backlog'] = state['offset'] > 0
+    return state
+
+def _read_chunk(path, state):
+    with open(path, 'rb') as f:
+        f.seek(state['offset'])
+        data = f.read(TAIL_MAX_BYTES)
+    state['offset'] += len(data)
+    *complete, state['partial'] = (state['partial'] + data).split(b'\n')
+    if complete and state.pop('skip_partial', False):
+        complete = complete[1:]
+    return [line.decode('utf-8', 'replace') for line in complete]
+
+def read_new_lines(state):
+    """Linhas completas escritas desde a última leitura, sobrevivendo à rotação.
+
+    Se o inode mudou, termina de ler o arquivo antigo (agora page_log.1) antes de
+    recomeçar do início do novo; se o arquivo encolheu (copytruncate), volta ao início.
+    """
+    try:
+        st = os.stat(state['path'])
+    except FileNotFoundError:
+        return []
+
+    lines = []
+    if st.st_ino != state['inode']:
+        rotated = state['path'] + '.1'
+        try:
+            if state['inode'] is not None and os.stat(rotated).st_ino == state['inode']:
+                lines += _read_chunk(rotated, state)
+        except FileNotFoundError:
+            pass
+        state.update(inode=st.st_ino, offset=0, partial=b'')
+    elif st.st_size < state['offset']:
+        state.update(offset=0, partial=b'')
+
+    lines += _read_chunk(state['path'], state)
+    return lines
+
+def tail_page_totals(state, totals):
+    """Soma as linhas novas do page_log nos totais por job (mesmo agregador da importação).
+
+    Totais que podem ter perdido linhas (job já imprimindo antes da releitura inicial
+    ou descartado por TAIL_MAX_JOBS) ficam marcados como incompletos.
+    """
+    backlog = state.pop('backlog', False)
+    evicted = state.setdefault('evicted', {})
+    for line in read_new_lines(state):
+        parsed = parse_line(line)
+        if parsed:
+            state['line_no'] += 1
+            job_id = parsed[2]
+            new = job_id not in totals
+            add_page_line(totals, parsed, 0, state['line_no'])
+            if new and (backlog or job_id in evicted):
+                totals[job_id]['incomplete'] = True
+    # Jobs que nunca concluem (cancelados) não podem acumular para sempre
+    while len(totals) > TAIL_MAX_JOBS:
+        job_id = next(iter(totals))
+        del totals[job_id]
+        evicted[job_id] = True
+    while len(evicted) > TAIL_MAX_JOBS:
+        del evicted[next(iter(evicted))]
+
+def pop_job_pages(totals, job_id):
+    """(páginas, completo) contadas no page_log para o job, ou None se não apareceu no log"""
+    job = totals.pop(job_id, None)
+    if job is None or job['pages'] <= 0:
+        return None
+    return job['pages'], not job.get('incomplete')
+
+# ========== IMPORTAÇÃO ==========
+def save_progress(checkpoint, jobs, files):
+    """Checkpoint de cada arquivo lido: um arquivo com jobs abertos volta ao primeiro deles.
+
+    files = {chave: (offset lido, leitura terminada)}; jobs abertos podem vir de uma
+    rotação anterior (o job continua no arquivo seguinte), que então ainda não está concluída.
+    """
+    open_offsets = {}
+    for job in jobs.values():
+        for key, first_offset in job['offsets'].items():
+            open_offsets[key] = min(open_offsets.get(key, first_offset), first_offset)
+    for key, (offset, finished) in list(files.items()):
+        if key in open_offsets:
+            checkpoint[key] = {'offset': open_offsets[key], 'done': False}
+        else:
+            checkpoint[key] = {'offset': offset, 'done': finished}
+            if finished:
+                del files[key]
+    save_checkpoint(checkpoint)
+
+def import_file(cursor, db, path, state, checkpoint, key, is_current, stats, jobs, files):
+    """Importa um arquivo a partir do offset salvo, gravando o checkpoint a cada FLUSH_LINES.
+
+    jobs é compartilhado entre os arquivos, para que um job que atravessa a rotação
+    seja gravado uma vez só, com as páginas dos dois arquivos.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    offset = state['offset']
+    stamp = None
+
+    with opener(path, 'rb') as f:
+        if offset:
+            f.seek(offset)
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                break  # linha ainda sendo escrita pelo CUPS
+            line_offset = offset
+            offset += len(raw)
+            stats['line_no'] += 1
+            stats['bytes'] += len(raw)
+            parsed = parse_line(raw.decode('utf-8', 'replace').rstrip('\n'))
+            if parsed:
+                add_page_line(jobs, parsed, line_offset, stats['line_no'])
+                jobs[parsed[2]].setdefault('offsets', {}).setdefault(key, line_offset)
+                stamp = parsed[3]
+            if stats['line_no'] % FLUSH_LINES == 0:
+                stats['jobs'] += flush_jobs(cursor, db, jobs, stats['line_no'], stamp)
+                files[key] = (offset, False)
+                save_progress(checkpoint, jobs, files)
+
+    # Os últimos jobs do arquivo podem continuar no próximo (ou ainda estar imprimindo)
+    stats['jobs'] += flush_jobs(cursor, db, jobs, stats['line_no'], stamp)
+    files[key] = (offset, not is_current)
+    save_progress(checkpoint, jobs, files)
+
+def import_page_log(cursor, db, log_dir=PAGE_LOG_DIR, restart=False):
+    """Importa o histórico do page_log (inclusive rotações gzip), retomando do checkpoint"""
+    checkpoint = {} if restart else load_checkpoint()
+    stats = {'bytes': 0, 'lines': 0, 'jobs': 0, 'line_no': 0}
+    current = os.path.join(log_dir, PAGE_LOG_NAME)
+    jobs = {}
+    files = {}
+    has_current = False
+
+    for path in page_log_files(log_dir):
+        st = os.stat(path)
+        key = file_key(path, st)
+        state = checkpoint.get(key, {'offset': 0, 'done': False})
+        if state['done']:
+            continue
+        if not path.endswith('.gz') and state['offset'] > st.st_size:
+            state = {'offset': 0, 'done': False}  # inode reaproveitado por outro arquivo
+        has_current = has_current or path == current
+        import_file(cursor, db, path, state, checkpoint, key, path == current, stats, jobs, files)
+        logging.info(f"{path} importado até o offset {checkpoint[key]['offset']}")
+
+    if not has_current and jobs:
+        # Só rotações neste diretório: nenhum arquivo seguinte vai continuar os jobs abertos
+        stats['jobs'] += flush_jobs(cursor, db, jobs, stats['line_no'], keep_open=False)
+        save_progress(checkpoint, jobs, files)
+
+    stats['lines'] = stats.pop('line_no')
+    return stats
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != "import":
+        print("Uso:")
+        print("  python3 page_log.py import [DIRETORIO] [--restart]   - Importa o histórico do page_log")
+        return
+
+    args = [arg for arg in sys.argv[2:] if not arg.startswith('--')]
+    log_dir = args[0] if args else PAGE_LOG_DIR
+    restart = "--restart" in sys.argv
+
+    logging.basicConfig(
+        filename="/var/log/page_log_import.log",
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s"
+    )
+
+    try:
+        db = mysql.connector.connect(
+            host=MYSQL_HOST,
+            user=MYSQL_USER,
+            password=MYSQL_PASS,
+            database=MYSQL_DB
+        )
+        cursor = db.cursor()
+
+        started = time.monotonic()
+        stats = import_page_log(cursor, db, log_dir, restart)
+        elapsed = max(time.monotonic() - started, 0.001)
+
+        mb = stats['bytes'] / (1024 * 1024)
+        message = (f"{stats['lines']} linhas ({mb:.1f} MB) lidas, {stats['jobs']} jobs novos "
+                   f"em {elapsed:.1f}s ({mb / elapsed * 60:.0f} MB/min)")
+        logging.info(message)
+        print(message)
+
+    except Exception as e:
+        logging.error(f"Erro na importação do page_log: {e}")
+        print(f"Erro: {e}")
+    finally:
+        try:
+            cursor.close()
+            db.close()
+        except:
+            pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/opt/cups_monitor_env/bin/python3
+import os
+import sys
+
+# Ponto de entrada único. Os módulos de cada subcomando (e com eles cups,
+# mysql.connector e smtplib) só são importados quando o subcomando é executado.
+
+ENV_FILE = "/opt/cups_monitor_env/.env"
+
+_db = None
+
+def get_db():
+    """Conexão MySQL compartilhada entre os passos de uma mesma execução"""
+    global _db
+    if _db is None:
+        import mysql.connector
+        from dotenv import load_dotenv
+        load_dotenv(ENV_FILE)
+        _db = mysql.connector.connect(
+            host=os.getenv("MYSQL_HOST"),
+            user=os.getenv("MYSQL_USER"),
+            password=os.getenv("MYSQL_PASS"),
+            database=os.getenv("MYSQL_DB")
+        )
+    return _db
+
+def close_db():
+    global _db
+    if _db is not None:
+        try:
+            _db.close()
+        except:
+            pass
+        _db = None
+
+# ========== SUBCOMANDOS ==========
+def cmd_monitor(args):
+    from cups_monitor import run_monitor
+    run_monitor(args)
+
+def cmd_init(args):
+    from cups_monitor import initialize_printers_from_cups
+    initialize_printers_from_cups()
+    print("Impressoras inicializadas no sistema")
+
+def cmd_quotas(args):
+    from quota_status import generate_quota_report
+    generate_quota_report(get_db())
+
+def cmd_status(args):
+    from quota_status import show_quota_status
+    # Snapshot recente dispensa banco; se outro passo já abriu conexão, reaproveita
+    show_quota_status(live="--live" in args, db=_db)
+
+def cmd_report(args):
+    from weekly_report import generate_weekly_report
+    generate_weekly_report(get_db())
+
+def cmd_digests(args):
+    from weekly_report import deliver_weekly_digests
+    deliver_weekly_digests(get_db(), dry_run="--dry-run" in args)
+
+def cmd_daily_check(args):
+    from daily_quota_check import daily_quota_check
+    daily_quota_check(get_db())
+
+def cmd_reset_month(args):
+    from reset_monthly_quotas import reset_monthly_quotas
+    reset_monthly_quotas(get_db())
+
+def delegate(module_name, script_name):
+    """Subcomando implementado pelo main() de outro script (mesmo interpretador)"""
+    def handler(args):
+        import importlib
+        module = importlib.import_module(module_name)
+        sys.argv = [script_name] + list(args)
+        return module.main()
+    return handler
+
+def cmd_admin(command):
+    def handler(args):
+        from manage_quotas import manage_quotas, DB_COMMANDS
+        sys.argv = ["manage_quotas.py", command] + list(args)
+        # enable/disable só falam com o CUPS: nada de conexão MySQL
+        manage_quotas(get_db() if command in DB_COMMANDS else None)
+    return handler
+
+COMMANDS = {
+    "monitor":     (cmd_monitor, "Serviço de monitoramento [--workers N] [--ha] [--record DIR | --replay DIR [--speed X]]"),
+    "init":        (cmd_init, "Cadastra as impressoras do CUPS no banco"),
+    "status":      (cmd_status, "Status das cotas [--live]"),
+    "quotas":      (cmd_quotas, "Tabela de cotas por impressora"),
+    "report":      (cmd_report, "Relatório semanal"),
+    "digests":     (cmd_digests, "Resumos semanais por destinatário [--dry-run]"),
+    "daily-check": (cmd_daily_check, "Verificação diária das cotas"),
+    "reset-month": (cmd_reset_month, "Reset mensal das cotas"),
+    "set":         (cmd_admin("set"), "ALVO COTA | ARQUIVO.csv - Define cotas [--dry-run]"),
+    "reset":       (cmd_admin("reset"), "ALVO - Zera o contador [--dry-run]"),
+    "enable":      (cmd_admin("enable"), "ALVO - Habilita impressoras [--dry-run]"),
+    "disable":     (cmd_admin("disable"), "ALVO - Bloqueia impressoras [--dry-run]"),
+    "usage":       (delegate("usage_rollup", "usage_rollup.py"), "Rollup diário (backfill/month/report)"),
+    "forecast":    (delegate("forecast", "forecast.py"), "Previsão de fim de mês"),
+    "export":      (delegate("export_jobs", "export_jobs.py"), "Export de print_jobs"),
+    "migrate":     (delegate("migrate", "migrate.py"), "Migrações do esquema (status/upgrade/check)"),
+    "retention":   (delegate("retention", "retention.py"), "Particionamento e arquivamento"),
+    "page-log":    (delegate("page_log", "page_log.py"), "Importação do page_log"),
+    "dashboard":   (delegate("dashboard", "dashboard.py"), "Painel web [PORTA] [HOST]"),
+    "leader":      (delegate("leader", "leader.py"), "Líder do modo ativo/passivo e último failover"),
+}
+
+# Passos que podem ser encadeados em "run" reaproveitando a mesma conexão
+STEPS = ("daily-check", "reset-month", "report", "digests", "status", "quotas")
+
+def usage():
+    print("Uso: printquota SUBCOMANDO [ARGUMENTOS]")
+    print()
+    for name, (_, description) in COMMANDS.items():
+        print(f"  {name:<12} {description}")
+    print(f"  {'run':<12} PASSO [PASSO...] - Executa passos em sequência com uma conexão "
+          f"({', '.join(STEPS)})")
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help", "help"):
+        usage()
+        return 0
+
+    command, args = argv[0], argv[1:]
+    try:
+        if command == "run":
+            invalid = [step for step in args if step not in STEPS]
+            if not args or invalid:
+                print(f"Passos inválidos: {' '.join(invalid)}" if invalid else "Informe ao menos um passo")
+                return 2
+            for step in args:
+                COMMANDS[step][0]([])
+            return 0
+
+        if command not in COMMANDS:
+            print(f"Subcomando inválido: {command}")
+            usage()
+            return 2
+        return COMMANDS[command][0](args) or 0
+    finally:
+        close_db()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,8 @@
 #!/opt/cups_monitor_env/bin/python3
-import mysql.connector
-import subprocess
+import sys
+import json
+import tempfile
+import time
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import os
@@ -13,86 +15,228 @@ MYSQL_USER = os.getenv("MYSQL_USER")
 MYSQL_PASS = os.getenv("MYSQL_PASS")
 MYSQL_DB   = os.getenv("MYSQL_DB")
 
-def show_quota_status():
-    """Mostra status atual das cotas"""
+# Snapshot publicado pelo cups_monitor.py a cada ciclo
+STATUS_SNAPSHOT = "/var/lib/cups_monitor/status.json"
+SNAPSHOT_TTL = 120  # segundos; acima disso consulta o banco diretamente
+
+CUPS_STATES = {3: "ociosa", 4: "imprimindo", 5: "parada"}
+PRINTER_REJECTING = 0x80000  # bit CUPS_PRINTER_REJECTING de printer-type
+
+# ========== COLETA ==========
+def cups_printer_states(cups_conn):
+    """Estado das filas via pycups: um getPrinters() e um getJobs() para a fila"""
+    printers = cups_conn.getPrinters()
+    queued = {}
+    jobs = cups_conn.getJobs(which_jobs='not-completed', requested_attributes=['job-printer-uri'])
+    for attrs in jobs.values():
+        name = str(attrs.get('job-printer-uri', '')).rstrip('/').split('/')[-1]
+        queued[name] = queued.get(name, 0) + 1
+
+    states = {}
+    for name, attrs in printers.items():
+        accepting = attrs.get('printer-is-accepting-jobs')
+        if accepting is None:
+            accepting = not (attrs.get('printer-type', 0) & PRINTER_REJECTING)
+        states[name] = {
+            'cups_state': CUPS_STATES.get(attrs.get('printer-state'), "?"),
+            'cups_message': attrs.get('printer-state-message', ''),
+            'accepting': bool(accepting),
+            'queued_jobs': queued.get(name, 0),
+        }
+    return states
+
+def collect_status(cursor, cups_conn=None):
+    """Monta o status: uso por impressora junto ao estado no CUPS, e alertas recentes"""
+    cups_states = None
+    if cups_conn is not None:
+        try:
+            cups_states = cups_printer_states(cups_conn)
+        except Exception:
+            cups_states = None
+
+    cursor.execute("""
+        SELECT name, monthly_quota, current_count,
+               ROUND((current_count / monthly_quota) * 100, 1) as usage_percent,
+               (monthly_quota - current_count) as remaining_pages
+        FROM printers
+        WHERE removed_at IS NULL
+        ORDER BY usage_percent DESC
+    """)
+    printers = []
+    for row in cursor.fetchall():
+        printer = {
+            'name': row['name'],
+            'monthly_quota': row['monthly_quota'],
+            'current_count': row['current_count'],
+            'usage_percent': float(row['usage_percent'] or 0),
+            'remaining_pages': row['remaining_pages'],
+        }
+        if cups_states is not None:
+            printer.update(cups_states.get(row['name'], {'cups_state': "ausente"}))
+        printers.append(printer)
+
+    cursor.execute("""
+        SELECT printer_name, alert_type, current_usage, quota_limit, created_at
+        FROM quota_alerts
+        WHERE created_at >= DATE_SUB(NOW(), INTERVAL 7 DAY)
+        ORDER BY created_at DESC
+        LIMIT 10
+    """)
+    alerts = [
+        {**alert, 'created_at': alert['created_at'].isoformat()}
+        for alert in cursor.fetchall()
+    ]
+
+    return {'generated_at': time.time(), 'printers': printers, 'alerts': alerts}
+
+# ========== SNAPSHOT ==========
+def write_snapshot(status, path=STATUS_SNAPSHOT):
+    """Grava o snapshot de forma atômica (arquivo temporário + rename)"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".status-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(status, f, ensure_ascii=False, default=str)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def load_snapshot(path=None, ttl=SNAPSHOT_TTL):
+    """Retorna o snapshot se existir e estiver dentro do TTL, senão None"""
+    path = path or STATUS_SNAPSHOT
+    try:
+        with open(path, encoding="utf-8") as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - status.get('generated_at', 0) > ttl:
+        return None
+    return status
+
+# ========== EXIBIÇÃO ==========
+def render_status(status, source):
+    generated = datetime.fromtimestamp(status['generated_at'])
+    print("\n" + "="*100)
+    print("SISTEMA DE COTAS DE IMPRESSÃO - STATUS ATUAL")
+    print(f"Data: {generated.strftime('%d/%m/%Y %H:%M:%S')} ({source})")
+    print("="*100)
+
+    print(f"{'IMPRESSORA':<20} {'COTA':<6} {'USADO':<6} {'%':<7} {'RESTANTE':<9} {'STATUS':<10} "
+          f"{'CUPS':<11} {'ACEITA':<7} {'FILA'}")
+    print("-"*100)
+
+    for row in status['printers']:
+        status_label = "OK"
+        if row['usage_percent'] >= 100:
+            status_label = "BLOQUEADA"
+        elif row['usage_percent'] >= 90:
+            status_label = "ALERTA"
+        elif row['usage_percent'] >= 70:
+            status_label = "ATENÇÃO"
+
+        accepting = row.get('accepting')
+        accepting_label = "?" if accepting is None else ("sim" if accepting else "NÃO")
+        print(f"{row['name']:<20} {row['monthly_quota']:<6} {row['current_count']:<6} "
+              f"{row['usage_percent']:>6.1f} {row['remaining_pages']:<9} {status_label:<10} "
+              f"{row.get('cups_state', '?'):<11} {accepting_label:<7} {row.get('queued_jobs', '?')}")
+
+    # Últimos alertas
+    if status['alerts']:
+        print("\nÚLTIMOS ALERTAS (7 dias):")
+        print("-"*100)
+        for alert in status['alerts']:
+            created_at = datetime.fromisoformat(alert['created_at'])
+            print(f"{created_at.strftime('%d/%m %H:%M')} - "
+                  f"{alert['printer_name']} - {alert['alert_type']} - "
+                  f"{alert['current_usage']}/{alert['quota_limit']}")
+
+    print("="*100)
+
+def connect():
+    import mysql.connector
+    return mysql.connector.connect(
+        host=MYSQL_HOST,
+        user=MYSQL_USER,
+        password=MYSQL_PASS,
+        database=MYSQL_DB
+    )
+
+def generate_quota_report(db=None):
+    """Tabela de uso das cotas por impressora (só o banco, sem CUPS)"""
+    own_db = db is None
+    cursor = None
     try:
-        db = mysql.connector.connect(
-            host=MYSQL_HOST,
-            user=MYSQL_USER,
-            password=MYSQL_PASS,
-            database=MYSQL_DB
-        )
+        if own_db:
+            db = connect()
         cursor = db.cursor(dictionary=True)
-        
-        print("\n" + "="*80)
-        print("SISTEMA DE COTAS DE IMPRESSÃO - STATUS ATUAL")
-        print(f"Data: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
-        print("="*80)
-        
-        # Status das impressoras
         cursor.execute("""
-            SELECT name, monthly_quota, current_count,
+            SELECT name, monthly_quota, current_count, 
                    ROUND((current_count / monthly_quota) * 100, 1) as usage_percent,
                    (monthly_quota - current_count) as remaining_pages
             FROM printers 
             ORDER BY usage_percent DESC
         """)
         
-        print(f"{'IMPRESSORA':<20} {'COTA':<6} {'USADO':<6} {'%':<7} {'RESTANTE':<9} {'STATUS'}")
+        print("\n" + "="*80)
+        print("RELATÓRIO DE COTAS DE IMPRESSÃO")
+        print("="*80)
+        print(f"{'IMPRESSORA':<20} {'COTA':<8} {'USADO':<8} {'%':<8} {'RESTANTE':<10}")
         print("-"*80)
         
         for row in cursor.fetchall():
-            status = "OK"
-            if row['usage_percent'] >= 100:
-                status = "BLOQUEADA"
-            elif row['usage_percent'] >= 90:
-                status = "ALERTA"
-            elif row['usage_percent'] >= 70:
-                status = "ATENÇÃO"
-            
-            print(f"{row['name']:<20} {row['monthly_quota']:<6} {row['current_count']:<6} "
-                  f"{row['usage_percent']:>6.1f} {row['remaining_pages']:<9} {status}")
-        
-        # Últimos alertas
-        cursor.execute("""
-            SELECT printer_name, alert_type, current_usage, quota_limit, created_at
-            FROM quota_alerts 
-            WHERE created_at >= DATE_SUB(NOW(), INTERVAL 7 DAY)
-            ORDER BY created_at DESC
-            LIMIT 10
-        """)
+            print(f"{row['name']:<20} {row['monthly_quota']:<8} {row['current_count']:<8} "
+                  f"{row['usage_percent']:<7}% {row['remaining_pages']:<10}")
         
-        alerts = cursor.fetchall()
-        if alerts:
-            print("\nÚLTIMOS ALERTAS (7 dias):")
-            print("-"*80)
-            for alert in alerts:
-                print(f"{alert['created_at'].strftime('%d/%m %H:%M')} - "
-                      f"{alert['printer_name']} - {alert['alert_type']} - "
-                      f"{alert['current_usage']}/{alert['quota_limit']}")
+        print("="*80)
         
-        # Status do CUPS
-        print("\nSTATUS DAS IMPRESSORAS NO CUPS:")
-        print("-"*80)
+    except Exception as e:
+        print(f"Erro ao gerar relatório: {e}")
+    finally:
         try:
-            result = subprocess.run(['lpstat', '-p'], capture_output=True, text=True)
-            if result.stdout:
-                for line in result.stdout.strip().split('\n'):
-                    if 'printer' in line.lower():
-                        print(line)
+            if cursor is not None:
+                cursor.close()
+            if own_db and db is not None:
+                db.close()
         except:
-            print("Erro ao consultar status do CUPS")
-        
-        print("="*80)
-        
+            pass
+
+def show_quota_status(live=False, db=None):
+    """Mostra status atual das cotas (snapshot do monitor, ou consulta ao vivo)"""
+    status = None if live else load_snapshot()
+    if status is not None:
+        render_status(status, "snapshot do monitor")
+        return
+
+    own_db = db is None
+    try:
+        if own_db:
+            db = connect()
+        cursor = db.cursor(dictionary=True)
+
+        try:
+            import cups
+            cups_conn = cups.Connection()
+        except Exception as e:
+            print(f"Erro ao consultar status do CUPS: {e}")
+            cups_conn = None
+
+        render_status(collect_status(cursor, cups_conn), "consulta ao vivo")
+
     except Exception as e:
         print(f"Erro ao consultar status: {e}")
     finally:
         try:
             cursor.close()
-            db.close()
+            if own_db:
+                db.close()
         except:
             pass
 
 if __name__ == "__main__":
-    show_quota_status()
+    show_quota_status(live="--live" in sys.argv[1:])
@@ -1,6 +1,9 @@
 #!/opt/cups_monitor_env/bin/python3
 import mysql.connector
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 import os
@@ -13,6 +16,9 @@ MYSQL_USER = os.getenv("MYSQL_USER")
 MYSQL_PASS = os.getenv("MYSQL_PASS")
 MYSQL_DB   = os.getenv("MYSQL_DB")
 
+CUPS_STOPPED = 5     # printer-state "parada"
+ENABLE_WORKERS = 16  # Chamadas IPP simultâneas na reabilitação
+
 # Log
 logging.basicConfig(
     filename="/var/log/quota_reset.log",
@@ -20,55 +26,119 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s"
 )
 
-def reset_monthly_quotas():
-    """Reset das cotas mensais com log completo"""
+# ========== REABILITAÇÃO ==========
+_cups_local = threading.local()
+
+def _thread_cups_connection():
+    """Uma conexão pycups por thread (a conexão não é segura entre threads)"""
+    import cups
+    if getattr(_cups_local, 'conn', None) is None:
+        _cups_local.conn = cups.Connection()
+    return _cups_local.conn
+
+def _enable_printer(name):
+    try:
+        _thread_cups_connection().enablePrinter(name)
+        return name, None
+    except Exception as e:
+        return name, e
+
+def reenable_stopped_printers(names, workers=ENABLE_WORKERS):
+    """Reabilita, via IPP e em paralelo, só as filas cadastradas que estão paradas.
+
+    Retorna (reabilitadas, falhas).
+    """
+    import cups
+    printers = cups.Connection().getPrinters()
+    stopped = [name for name in names
+               if printers.get(name, {}).get('printer-state') == CUPS_STOPPED]
+    if not stopped:
+        return [], []
+
+    enabled, failed = [], []
+    with ThreadPoolExecutor(max_workers=min(workers, len(stopped))) as pool:
+        for name, error in pool.map(_enable_printer, stopped):
+            if error is None:
+                enabled.append(name)
+            else:
+                failed.append(name)
+                logging.error(f"Falha ao habilitar {name}: {error}")
+    return enabled, failed
+
+# ========== RESET ==========
+def record_reset_run(cursor, db, started_at, summary):
+    cursor.execute("""
+        INSERT INTO quota_reset_runs
+            (started_at, finished_at, printers, pages_before, exhausted, reenabled, reenable_failures, duration_ms)
+        VALUES (%s, NOW(), %s, %s, %s, %s, %s, %s)
+    """, (started_at, summary['printers'], summary['pages_before'], summary['exhausted'],
+          summary['reenabled'], summary['reenable_failures'], summary['duration_ms']))
+    db.commit()
+
+def reset_monthly_quotas(db=None):
+    """Reset das cotas mensais com resumo da execução (reaproveita a conexão recebida, se houver)"""
+    own_db = db is None
+    started = time.monotonic()
+    started_at = datetime.now()
     try:
-        db = mysql.connector.connect(
-            host=MYSQL_HOST,
-            user=MYSQL_USER,
-            password=MYSQL_PASS,
-            database=MYSQL_DB
-        )
+        if own_db:
+            db = mysql.connector.connect(
+                host=MYSQL_HOST,
+                user=MYSQL_USER,
+                password=MYSQL_PASS,
+                database=MYSQL_DB
+            )
         cursor = db.cursor(dictionary=True)
         
-        # Registra uso antes do reset
-        cursor.execute("SELECT name, current_count, monthly_quota FROM printers")
-        printers = cursor.fetchall()
-        
         logging.info("=== INÍCIO RESET MENSAL ===")
-        for printer in printers:
-            logging.info(f"ANTES: {printer['name']} - {printer['current_count']}/{printer['monthly_quota']} páginas")
+
+        # O uso anterior de cada impressora fica registrado nos alertas de reset
+        cursor.execute("SELECT name FROM printers")
+        names = [row['name'] for row in cursor.fetchall()]
+        cursor.execute("""
+            SELECT COUNT(*) AS printers,
+                   COALESCE(SUM(current_count), 0) AS pages_before,
+                   COALESCE(SUM(current_count >= monthly_quota), 0) AS exhausted
+            FROM printers
+        """)
+        summary = {key: int(value) for key, value in cursor.fetchone().items()}
         
-        # Registra alertas de reset
+        # Alertas de reset e contadores na mesma transação
         cursor.execute("""
             INSERT INTO quota_alerts (printer_name, alert_type, current_usage, quota_limit, message)
             SELECT name, 'QUOTA_RESET', current_count, monthly_quota, 
                    CONCAT('Reset mensal automático - Uso anterior: ', current_count, ' páginas')
             FROM printers
         """)
-        
-        # Reset dos contadores
-        cursor.execute("UPDATE printers SET current_count = 0, updated_at = NOW()")
+        cursor.execute("UPDATE printers SET current_count = 0, alert_level = 0, updated_at = NOW()")
         db.commit()
         
-        logging.info("Cotas mensais resetadas com sucesso")
-        logging.info("=== FIM RESET MENSAL ===")
+        logging.info(f"Cotas mensais resetadas: {summary['printers']} impressoras, "
+                      f"{summary['pages_before']} páginas no mês, {summary['exhausted']} esgotadas")
         
-        # Habilita impressoras que podem ter sido bloqueadas
-        import subprocess
-        for printer in printers:
-            try:
-                subprocess.run(['cupsenable', printer['name']], check=True)
-                logging.info(f"Impressora {printer['name']} habilitada")
-            except:
-                pass
+        # Habilita as impressoras que ficaram bloqueadas
+        try:
+            enabled, failed = reenable_stopped_printers(names)
+        except Exception as e:
+            logging.error(f"Erro ao consultar o CUPS: {e}")
+            enabled, failed = [], names
+        if enabled:
+            logging.info(f"Impressoras habilitadas: {', '.join(enabled)}")
+        summary['reenabled'] = len(enabled)
+        summary['reenable_failures'] = len(failed)
+        summary['duration_ms'] = int((time.monotonic() - started) * 1000)
+
+        record_reset_run(cursor, db, started_at, summary)
+        logging.info(f"=== FIM RESET MENSAL ({summary['duration_ms']} ms, "
+                     f"{summary['reenabled']} habilitadas, {summary['reenable_failures']} falhas) ===")
         
     except Exception as e:
         logging.error(f"ERRO no reset mensal: {e}")
     finally:
         try:
             cursor.close()
-            db.close()
+            if own_db:
+                db.close()
         except:
             pass
 
@@ -0,0 +1,222 @@
+#!/opt/cups_monitor_env/bin/python3
+import mysql.connector
+import sys
+import logging
+from datetime import date
+from dotenv import load_dotenv
+import os
+
+from export_jobs import export_query
+
+# Carregar variáveis do .env
+load_dotenv("/opt/cups_monitor_env/.env")
+
+MYSQL_HOST = os.getenv("MYSQL_HOST")
+MYSQL_USER = os.getenv("MYSQL_USER")
+MYSQL_PASS = os.getenv("MYSQL_PASS")
+MYSQL_DB   = os.getenv("MYSQL_DB")
+
+RETENTION_MONTHS = 12        # Meses mantidos em print_jobs (além do mês atual)
+FUTURE_MONTHS = 3            # Partições criadas à frente do mês atual
+ARCHIVE_DIR = "/var/lib/cups_monitor/archive"
+FETCH_SIZE = 5000            # Linhas por fetchmany no arquivamento
+
+logging.basicConfig(
+    filename="/var/log/quota_retention.log",
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+# ========== HELPERS ==========
+def add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+def partition_name(month_start):
+    return f"p{month_start:%Y%m}"
+
+def partition_clause(month_start):
+    upper = add_months(month_start, 1)
+    return f"PARTITION {partition_name(month_start)} VALUES LESS THAN ('{upper:%Y-%m-%d}')"
+
+def get_partitions(cursor):
+    """Partições atuais de print_jobs (vazio se a tabela não é particionada)"""
+    cursor.execute("""
+        SELECT PARTITION_NAME AS name, TABLE_ROWS AS row_estimate
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'print_jobs'
+          AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """)
+    return cursor.fetchall()
+
+# ========== PARTICIONAMENTO ==========
+def partition_print_jobs(cursor):
+    """Converte print_jobs para particionamento mensal por completed_at.
+
+    O MySQL exige que toda chave única contenha a coluna de partição, então a
+    PRIMARY KEY e os índices únicos passam a incluir completed_at. A unicidade do
+    job_id passa a ser garantida por print_job_ids (migração 8), exigida aqui.
+    completed_at passa a ser NOT NULL: linhas antigas sem data de conclusão recebem
+    a da última gravação (updated_at, ou created_at) antes da conversão.
+    """
+    if get_partitions(cursor):
+        print("print_jobs já está particionada")
+        return
+    cursor.execute("""
+        SELECT 1 FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'print_job_ids'
+    """)
+    if cursor.fetchone() is None:
+        raise RuntimeError("print_job_ids não existe; rode migrate.py upgrade antes de particionar")
+
+    cursor.execute("""
+        SELECT INDEX_NAME AS name, GROUP_CONCAT(COLUMN_NAME ORDER BY SEQ_IN_INDEX) AS cols
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'print_jobs' AND NON_UNIQUE = 0
+        GROUP BY INDEX_NAME
+    """)
+    # Sem isso o MODIFY ... NOT NULL aborta em qualquer linha antiga com completed_at NULL
+    cursor.execute("""
+        UPDATE print_jobs SET completed_at = COALESCE(updated_at, created_at, NOW())
+        WHERE completed_at IS NULL
+    """)
+    if cursor.rowcount:
+        logging.warning(f"{cursor.rowcount} job(s) sem completed_at receberam a data da última gravação")
+        print(f"{cursor.rowcount} job(s) sem completed_at receberam a data da última gravação")
+
+    changes = ["MODIFY completed_at DATETIME NOT NULL"]
+    for index in cursor.fetchall():
+        cols = index['cols'].split(',')
+        if 'completed_at' in cols:
+            continue
+        col_list = ", ".join(f"`{c}`" for c in cols + ['completed_at'])
+        if index['name'] == 'PRIMARY':
+            changes.append(f"DROP PRIMARY KEY, ADD PRIMARY KEY ({col_list})")
+        else:
+            changes.append(f"DROP INDEX `{index['name']}`, ADD UNIQUE INDEX `{index['name']}` ({col_list})")
+    cursor.execute(f"ALTER TABLE print_jobs {', '.join(changes)}")
+
+    cursor.execute("SELECT MIN(completed_at) AS first FROM print_jobs")
+    first = cursor.fetchone()['first']
+    month = date((first or date.today()).year, (first or date.today()).month, 1)
+    last = add_months(date.today().replace(day=1), FUTURE_MONTHS)
+    clauses = []
+    while month <= last:
+        clauses.append(partition_clause(month))
+        month = add_months(month, 1)
+    clauses.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+
+    cursor.execute(f"ALTER TABLE print_jobs PARTITION BY RANGE COLUMNS(completed_at) ({', '.join(clauses)})")
+    logging.info(f"print_jobs particionada em {len(clauses)} partições")
+    print(f"print_jobs particionada em {len(clauses)} partições")
+
+def ensure_future_partitions(cursor):
+    """Separa de pmax as partições dos próximos FUTURE_MONTHS meses"""
+    existing = {p['name'] for p in get_partitions(cursor)}
+    if 'pmax' not in existing:
+        return 0
+
+    month = date.today().replace(day=1)
+    clauses = []
+    for _ in range(FUTURE_MONTHS + 1):
+        if partition_name(month) not in existing:
+            clauses.append(partition_clause(month))
+        month = add_months(month, 1)
+    if not clauses:
+        return 0
+
+    clauses.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+    cursor.execute(f"ALTER TABLE print_jobs REORGANIZE PARTITION pmax INTO ({', '.join(clauses)})")
+    logging.info(f"{len(clauses) - 1} partição(ões) futura(s) criada(s)")
+    return len(clauses) - 1
+
+# ========== ARQUIVAMENTO ==========
+def archive_partition(db, name):
+    """Exporta a partição para JSONL gzip em streaming e remove a partição.
+
+    Usa o export não bufferizado com fetchmany, então a memória é constante
+    independentemente do tamanho da partição.
+    """
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, f"print_jobs_{name[1:]}.jsonl.gz")
+    rows = export_query(db, f"SELECT * FROM print_jobs PARTITION ({name})", (), path,
+                        fmt='jsonl', compress=True, fetch_size=FETCH_SIZE)
+
+    cursor = db.cursor()
+    try:
+        cursor.execute(f"ALTER TABLE print_jobs DROP PARTITION {name}")
+    finally:
+        cursor.close()
+
+    logging.info(f"Partição {name} arquivada em {path} ({rows} jobs)")
+    return path, rows
+
+def archive_old_partitions(db, retention_months=RETENTION_MONTHS):
+    """Arquiva as partições mais antigas que a janela de retenção"""
+    cursor = db.cursor(dictionary=True)
+    try:
+        partitions = get_partitions(cursor)
+    finally:
+        cursor.close()
+
+    oldest_kept = partition_name(add_months(date.today().replace(day=1), -retention_months))
+    archived = []
+    for partition in partitions:
+        name = partition['name']
+        if name == 'pmax' or name >= oldest_kept:
+            continue
+        archived.append(archive_partition(db, name))
+    return archived
+
+def main():
+    if len(sys.argv) < 2:
+        print("Uso:")
+        print("  python3 retention.py partition          - Particiona print_jobs por mês")
+        print("  python3 retention.py maintain           - Cria partições futuras")
+        print("  python3 retention.py archive [MESES]    - Arquiva partições antigas e as remove")
+        print("  python3 retention.py status             - Lista partições")
+        return
+
+    command = sys.argv[1]
+
+    try:
+        db = mysql.connector.connect(
+            host=MYSQL_HOST,
+            user=MYSQL_USER,
+            password=MYSQL_PASS,
+            database=MYSQL_DB
+        )
+        cursor = db.cursor(dictionary=True)
+
+        if command == "partition":
+            partition_print_jobs(cursor)
+
+        elif command == "maintain":
+            created = ensure_future_partitions(cursor)
+            print(f"{created} partição(ões) criada(s)")
+
+        elif command == "archive":
+            months = int(sys.argv[2]) if len(sys.argv) > 2 else RETENTION_MONTHS
+            for path, rows in archive_old_partitions(db, months):
+                print(f"{path}: {rows} jobs")
+
+        elif command == "status":
+            for partition in get_partitions(cursor):
+                print(f"{partition['name']:<10} ~{partition['row_estimate']} jobs")
+
+        else:
+            print("Comando inválido")
+
+    except Exception as e:
+        logging.error(f"Erro na retenção: {e}")
+        print(f"Erro: {e}")
+    finally:
+        try:
+            cursor.close()
+            db.close()
+        except:
+            pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/opt/cups_monitor_env/bin/python3
+import mysql.connector
+import sys
+from datetime import date, datetime, timedelta
+from dotenv import load_dotenv
+import os
+
+# Carregar variáveis do .env
+load_dotenv("/opt/cups_monitor_env/.env")
+
+MYSQL_HOST = os.getenv("MYSQL_HOST")
+MYSQL_USER = os.getenv("MYSQL_USER")
+MYSQL_PASS = os.getenv("MYSQL_PASS")
+MYSQL_DB   = os.getenv("MYSQL_DB")
+
+# Incremento do rollup diário (mesma transação dos inserts do monitor)
+ROLLUP_UPSERT = """
+    INSERT INTO print_usage_daily (day, printer, user, jobs, pages, weighted_pages)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE jobs = jobs + VALUES(jobs),
+                            pages = pages + VALUES(pages),
+                            weighted_pages = weighted_pages + VALUES(weighted_pages)
+"""
+
+# Dias ainda abertos (hoje e ontem, DAYS_TO_LOOK_BACK = 1 no monitor): o monitor ainda
+# soma incrementos neles, e o DELETE + INSERT do backfill perderia ou dobraria esses
+# incrementos. Só entram no backfill com o monitor parado (include_open).
+OPEN_DAYS = 2
+
+def apply_rollup(cursor, increments):
+    """Aplica incrementos {(dia, impressora, usuário): [jobs, páginas, custo]} em um executemany"""
+    cursor.executemany(ROLLUP_UPSERT, [
+        (day, printer, user, jobs, pages, cost)
+        for (day, printer, user), (jobs, pages, cost) in increments.items()
+    ])
+
+def backfill_rollup(cursor, db, since=None, until=None, include_open=False):
+    """Recalcula o rollup a partir de print_jobs, um dia por transação (idempotente).
+
+    Conta só o que o monitor conta (jobs com custo > 0). Os OPEN_DAYS mais recentes
+    ficam de fora, salvo include_open (monitor parado).
+    """
+    if since is None:
+        cursor.execute("SELECT MIN(completed_at) AS first FROM print_jobs")
+        first = cursor.fetchone()['first']
+        if first is None:
+            return 0
+        since = first.date()
+    last_closed = date.today() - timedelta(days=OPEN_DAYS)
+    until = until or date.today()
+    if not include_open and until > last_closed:
+        print(f"Dias a partir de {last_closed + timedelta(days=1):%d/%m/%Y} ignorados (monitor ainda grava "
+              f"neles); use --include-open com o monitor parado")
+        until = last_closed
+
+    days = 0
+    day = since
+    while day <= until:
+        start = datetime.combine(day, datetime.min.time())
+        cursor.execute("DELETE FROM print_usage_daily WHERE day = %s", (day,))
+        cursor.execute("""
+            INSERT INTO print_usage_daily (day, printer, user, jobs, pages, weighted_pages)
+            SELECT DATE(completed_at), printer, user, COUNT(*),
+                   SUM(COALESCE(pages, 0)), SUM(COALESCE(weighted_pages, pages))
+            FROM print_jobs
+            WHERE completed_at >= %s AND completed_at < %s
+              AND COALESCE(weighted_pages, pages) > 0
+            GROUP BY DATE(completed_at), printer, user
+        """, (start, start + timedelta(days=1)))
+        db.commit()
+        days += 1
+        day += timedelta(days=1)
+    return days
+
+def usage_by(cursor, key, since, until, limit=None):
+    """Totais por usuário ou impressora no período [since, until], lidos do rollup"""
+    if key not in ('user', 'printer'):
+        raise ValueError(f"Agrupamento inválido: {key}")
+    query = f"""
+        SELECT {key}, SUM(jobs) as jobs, SUM(pages) as pages, SUM(weighted_pages) as cost
+        FROM print_usage_daily
+        WHERE day BETWEEN %s AND %s
+        GROUP BY {key}
+        ORDER BY cost DESC
+    """
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    cursor.execute(query, (since, until))
+    return cursor.fetchall()
+
+def print_usage_report(cursor, since, until):
+    """Relatório ad-hoc/mensal por impressora e por usuário"""
+    print("\n" + "="*80)
+    print(f"USO DE IMPRESSÃO - {since.strftime('%d/%m/%Y')} a {until.strftime('%d/%m/%Y')}")
+    print("="*80)
+    for key, label in (('printer', 'IMPRESSORA'), ('user', 'USUÁRIO')):
+        print(f"{label:<25} {'JOBS':>6} {'PÁGINAS':>8} {'CUSTO':>8}")
+        print("-"*80)
+        for row in usage_by(cursor, key, since, until):
+            print(f"{row[key]:<25} {row['jobs']:>6} {row['pages']:>8} {row['cost']:>8}")
+        print()
+    print("="*80)
+
+def parse_day(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+def month_range(value):
+    first = datetime.strptime(value, "%Y-%m").date()
+    next_month = (first.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return first, next_month - timedelta(days=1)
+
+def main():
+    if len(sys.argv) < 2:
+        print("Uso:")
+        print("  python3 usage_rollup.py backfill [DESDE] [ATE] [--include-open]")
+        print("                                                   - Recalcula o rollup (AAAA-MM-DD)")
+        print("  python3 usage_rollup.py month [AAAA-MM]          - Relatório mensal")
+        print("  python3 usage_rollup.py report DESDE ATE         - Relatório do período")
+        return
+
+    command = sys.argv[1]
+
+    try:
+        db = mysql.connector.connect(
+            host=MYSQL_HOST,
+            user=MYSQL_USER,
+            password=MYSQL_PASS,
+            database=MYSQL_DB
+        )
+        cursor = db.cursor(dictionary=True)
+
+        if command == "backfill":
+            args = [arg for arg in sys.argv[2:] if not arg.startswith('--')]
+            since = parse_day(args[0]) if len(args) > 0 else None
+            until = parse_day(args[1]) if len(args) > 1 else None
+            days = backfill_rollup(cursor, db, since, until, "--include-open" in sys.argv)
+            print(f"Rollup recalculado para {days} dia(s)")
+
+        elif command == "month":
+            month = sys.argv[2] if len(sys.argv) > 2 else date.today().strftime("%Y-%m")
+            print_usage_report(cursor, *month_range(month))
+
+        elif command == "report" and len(sys.argv) == 4:
+            print_usage_report(cursor, parse_day(sys.argv[2]), parse_day(sys.argv[3]))
+
+        else:
+            print("Comando inválido")
+
+    except Exception as e:
+        print(f"Erro: {e}")
+    finally:
+        try:
+            cursor.close()
+            db.close()
+        except:
+            pass
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,17 @@
 #!/opt/cups_monitor_env/bin/python3
 import mysql.connector
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from datetime import datetime
+import sys
+import logging
+import queue
+import threading
+from collections import defaultdict
+from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
 import os
 
+from usage_rollup import usage_by
+from forecast import forecast_printers, forecast_lines
+
 # Carregar variáveis do .env
 load_dotenv("/opt/cups_monitor_env/.env")
 
@@ -16,15 +21,26 @@ MYSQL_PASS = os.getenv("MYSQL_PASS")
 MYSQL_DB   = os.getenv("MYSQL_DB")
 ADMIN_EMAIL = "admin@fab.mil.br"  # ALTERE AQUI
 
-def generate_weekly_report():
-    """Gera relatório semanal de uso"""
+logging.basicConfig(
+    filename="/var/log/weekly_report.log",
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+DIGEST_SMTP_CONNECTIONS = 4  # Sessões SMTP simultâneas no envio dos resumos
+DIGEST_TOP_USERS = 5         # Usuários listados por impressora no resumo
+
+def generate_weekly_report(db=None):
+    """Gera relatório semanal de uso (reaproveita a conexão recebida, se houver)"""
+    own_db = db is None
     try:
-        db = mysql.connector.connect(
-            host=MYSQL_HOST,
-            user=MYSQL_USER,
-            password=MYSQL_PASS,
-            database=MYSQL_DB
-        )
+        if own_db:
+            db = mysql.connector.connect(
+                host=MYSQL_HOST,
+                user=MYSQL_USER,
+                password=MYSQL_PASS,
+                database=MYSQL_DB
+            )
         cursor = db.cursor(dictionary=True)
         
         # Relatório de cotas
@@ -59,21 +75,24 @@ def generate_weekly_report():
             report.append(f"{row['name']:<20} {row['current_count']:>4}/{row['monthly_quota']:<4} "
                          f"({row['usage_percent']:>5.1f}%) - {status}")
         
-        # Top usuários da semana
-        cursor.execute("""
-            SELECT user, COUNT(*) as jobs, SUM(COALESCE(pages,1)) as pages
-            FROM print_jobs 
-            WHERE completed_at >= DATE_SUB(NOW(), INTERVAL 7 DAY)
-            GROUP BY user 
-            ORDER BY pages DESC 
-            LIMIT 10
-        """)
+        # Top usuários da semana (rollup diário, sem varrer print_jobs)
+        today = date.today()
+        top_users = usage_by(cursor, 'user', today - timedelta(days=6), today, limit=10)
         
         report.append("")
         report.append("TOP 10 USUÁRIOS DA SEMANA:")
         report.append("-" * 50)
-        for row in cursor.fetchall():
-            report.append(f"{row['user']:<25} {row['jobs']:>3} jobs, {row['pages']:>4} páginas")
+        for row in top_users:
+            report.append(f"{row['user']:<25} {row['jobs']:>3} jobs, {row['pages']:>4} páginas, "
+                         f"custo {row['cost']:>4}")
+        
+        # Previsão de esgotamento até o fim do mês (rollup diário)
+        at_risk = forecast_lines(forecast_printers(cursor))
+        if at_risk:
+            report.append("")
+            report.append("PREVISÃO: COTA ESGOTA ANTES DO FIM DO MÊS:")
+            report.append("-" * 50)
+            report.extend(at_risk)
         
         report_text = "\n".join(report)
         print(report_text)
@@ -90,9 +109,179 @@ def generate_weekly_report():
     finally:
         try:
             cursor.close()
-            db.close()
+            if own_db:
+                db.close()
+        except:
+            pass
+
+# ========== RESUMOS POR DESTINATÁRIO ==========
+def collect_digest_data(cursor, since, until):
+    """Dados de todos os resumos em três consultas: impressoras, uso da semana e destinatários"""
+    cursor.execute("""
+        SELECT name, department, monthly_quota, current_count
+        FROM printers
+        WHERE removed_at IS NULL
+    """)
+    printers = {row['name']: {**row, 'jobs': 0, 'pages': 0, 'cost': 0, 'users': []}
+                for row in cursor.fetchall()}
+
+    cursor.execute("""
+        SELECT printer, user, SUM(jobs) as jobs, SUM(pages) as pages, SUM(weighted_pages) as cost
+        FROM print_usage_daily
+        WHERE day BETWEEN %s AND %s
+        GROUP BY printer, user
+    """, (since, until))
+    for row in cursor.fetchall():
+        printer = printers.get(row['printer'])
+        if printer is None:
+            continue
+        printer['jobs'] += int(row['jobs'])
+        printer['pages'] += int(row['pages'])
+        printer['cost'] += int(row['cost'])
+        printer['users'].append(row)
+
+    cursor.execute("SELECT email, department, printer_name FROM report_recipients")
+    subscriptions = defaultdict(set)
+    by_department = defaultdict(list)
+    for name, printer in printers.items():
+        by_department[printer['department']].append(name)
+    for row in cursor.fetchall():
+        if row['printer_name'] in printers:
+            subscriptions[row['email']].add(row['printer_name'])
+        if row['department']:
+            subscriptions[row['email']].update(by_department.get(row['department'], ()))
+    return printers, subscriptions
+
+def render_printer_section(printer):
+    percent = printer['current_count'] * 100 / printer['monthly_quota'] if printer['monthly_quota'] else 0
+    lines = [f"{printer['name']} ({printer['department'] or 'sem departamento'})",
+             f"  Cota do mês: {printer['current_count']}/{printer['monthly_quota']} ({percent:.1f}%)",
+             f"  Semana: {printer['jobs']} jobs, {printer['pages']} páginas, custo {printer['cost']}"]
+    top_users = sorted(printer['users'], key=lambda r: -r['cost'])[:DIGEST_TOP_USERS]
+    for row in top_users:
+        lines.append(f"    {row['user']:<25} {row['jobs']:>4} jobs, {row['pages']:>5} páginas")
+    return "\n".join(lines)
+
+def render_digests(printers, subscriptions, since, until):
+    """Monta os resumos; cada seção de impressora é renderizada uma vez e compartilhada"""
+    sections = {}
+    digests = []
+    period = f"{since.strftime('%d/%m')} a {until.strftime('%d/%m/%Y')}"
+    for email, names in sorted(subscriptions.items()):
+        if not names:
+            continue
+        body = [f"RESUMO SEMANAL DE IMPRESSÃO - {period}", "=" * 50, ""]
+        for name in sorted(names, key=lambda n: -printers[n]['cost']):
+            if name not in sections:
+                sections[name] = render_printer_section(printers[name])
+            body.append(sections[name])
+            body.append("")
+        subject = f"Resumo semanal de impressão - {period} ({len(names)} impressora(s))"
+        digests.append((email, subject, "\n".join(body)))
+    return digests
+
+def send_digests(digests, connections=DIGEST_SMTP_CONNECTIONS):
+    """Envia os resumos por um pool de sessões SMTP; cada thread mantém uma sessão aberta.
+
+    Retorna (enviados, falhas).
+    """
+    from notifications import smtp_connect, build_message
+
+    pending = queue.Queue()
+    for digest in digests:
+        pending.put(digest)
+    results = {'sent': 0, 'failed': 0}
+    lock = threading.Lock()
+
+    def worker():
+        smtp = None
+        try:
+            while True:
+                try:
+                    email, subject, body = pending.get_nowait()
+                except queue.Empty:
+                    return
+                ok = False
+                for _ in range(2):  # Uma nova tentativa com sessão nova
+                    try:
+                        if smtp is None:
+                            smtp = smtp_connect()
+                        smtp.send_message(build_message(email, subject, body))
+                        ok = True
+                        break
+                    except Exception as e:
+                        logging.error(f"Erro ao enviar resumo para {email}: {e}")
+                        try:
+                            smtp.close()
+                        except Exception:
+                            pass
+                        smtp = None
+                with lock:
+                    results['sent' if ok else 'failed'] += 1
+        finally:
+            if smtp is not None:
+                try:
+                    smtp.quit()
+                except Exception:
+                    pass
+
+    threads = [threading.Thread(target=worker, name=f"digest-{i}")
+               for i in range(min(connections, len(digests)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results['sent'], results['failed']
+
+def deliver_weekly_digests(db=None, dry_run=False):
+    """Envia os resumos semanais por departamento/responsável (reaproveita a conexão recebida, se houver)"""
+    own_db = db is None
+    try:
+        if own_db:
+            db = mysql.connector.connect(
+                host=MYSQL_HOST,
+                user=MYSQL_USER,
+                password=MYSQL_PASS,
+                database=MYSQL_DB
+            )
+        cursor = db.cursor(dictionary=True)
+
+        until = date.today()
+        since = until - timedelta(days=6)
+        printers, subscriptions = collect_digest_data(cursor, since, until)
+        digests = render_digests(printers, subscriptions, since, until)
+
+        if dry_run:
+            for email, subject, _ in digests:
+                print(f"{email:<40} {subject}")
+            print(f"{len(digests)} resumo(s) seriam enviados")
+            return len(digests), 0
+
+        sent, failed = send_digests(digests)
+        logging.info(f"Resumos semanais: {sent} enviados, {failed} falhas")
+        print(f"{sent} resumo(s) enviados, {failed} falha(s)")
+        return sent, failed
+
+    except Exception as e:
+        print(f"Erro ao enviar resumos: {e}")
+        return 0, 0
+    finally:
+        try:
+            cursor.close()
+            if own_db:
+                db.close()
         except:
             pass
 
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "digests":
+        deliver_weekly_digests(dry_run="--dry-run" in sys.argv[2:])
+    elif len(sys.argv) > 1:
+        print("Uso:")
+        print("  python3 weekly_report.py                     - Relatório semanal")
+        print("  python3 weekly_report.py digests [--dry-run] - Resumos por departamento/responsável")
+    else:
+        generate_weekly_report()
+
 if __name__ == "__main__":
-    generate_weekly_report()
+    main()